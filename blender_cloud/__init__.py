@@ -76,7 +76,7 @@ def register():
             sys.modules[modname] = new_module
             return new_module
 
-        reload_mod('blendfile')
+        blendfile = reload_mod('blendfile')
         reload_mod('home_project')
         reload_mod('utils')
         reload_mod('pillar')
@@ -93,6 +93,9 @@ def register():
         from . import (blender, texture_browser, async_loop, settings_sync, blendfile, home_project,
                        image_sharing, attract, flamenco, project_specific)
 
+    # Parsed DNA of blend files is cached, so that they can be opened quicker next time.
+    blendfile.dna_cache_directory = cache.shared_cache_directory('blendfile_dna')
+
     async_loop.setup_asyncio_executor()
     async_loop.register()
 
@@ -0,0 +1,327 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""Minimal non-blocking HTTP/1.1 client on top of asyncio streams.
+
+Used for downloading files without tying up a thread per download. Connections
+are kept alive and reused per host. Only GET requests without a proxy are
+supported; everything else goes through Requests.
+"""
+
+import asyncio
+import collections
+import logging
+import ssl
+import time
+import urllib.parse
+import urllib.request
+
+import requests.certs
+import requests.exceptions
+import requests.structures
+
+log = logging.getLogger(__name__)
+
+MAX_IDLE_CONNECTIONS_PER_HOST = 8
+# Idle connections older than this aren't reused, as the server may have closed them.
+IDLE_TIMEOUT_SECS = 30
+CONNECT_TIMEOUT_SECS = 30
+READ_TIMEOUT_SECS = 60
+MAX_REDIRECTS = 10
+REDIRECT_STATUS_CODES = {301, 302, 303, 307, 308}
+NO_BODY_STATUS_CODES = {204, 304}
+
+_pool = None  # ConnectionPool object, late-instantiated by connection_pool().
+
+
+def can_handle(url: str) -> bool:
+    """Returns whether the URL can be fetched with this module, or needs Requests."""
+
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in {'http', 'https'}:
+        return False
+
+    proxies = urllib.request.getproxies()
+    if not (proxies.get(parts.scheme) or proxies.get('all')):
+        return True
+    # Proxies are left to Requests.
+    return bool(urllib.request.proxy_bypass(parts.hostname))
+
+
+def connection_pool() -> 'ConnectionPool':
+    """Returns the connection pool shared by all requests."""
+
+    global _pool
+
+    if _pool is None:
+        _pool = ConnectionPool()
+    return _pool
+
+
+async def get(url: str, headers: dict = None) -> 'Response':
+    """Performs a GET request, following redirects.
+
+    Only the status and headers are read; read the body with Response.read()
+    and close the response when done.
+
+    :raises requests.exceptions.ConnectionError: when the server can't be reached.
+    :raises requests.exceptions.Timeout: when the server doesn't respond in time.
+    """
+
+    return await connection_pool().get(url, headers or {})
+
+
+async def _with_timeout(coro, timeout=None):
+    if timeout is None:
+        timeout = READ_TIMEOUT_SECS
+    try:
+        return await asyncio.wait_for(coro, timeout)
+    except (asyncio.TimeoutError, TimeoutError) as ex:
+        # Checked first, as on Python 3.11+ asyncio.TimeoutError is an OSError too.
+        raise requests.exceptions.Timeout('No response within %s seconds' % timeout) from ex
+    except OSError as ex:
+        raise requests.exceptions.ConnectionError(str(ex)) from ex
+
+
+class ConnectionPool:
+    """Keeps idle connections alive for reuse, per (scheme, host, port)."""
+
+    def __init__(self, max_idle_per_host=MAX_IDLE_CONNECTIONS_PER_HOST):
+        self.max_idle_per_host = max_idle_per_host
+        self._idle = collections.defaultdict(list)  # key -> [(reader, writer, idle since)]
+        self._ssl_context = None
+
+    def close(self):
+        """Closes all idle connections."""
+
+        for idle in self._idle.values():
+            for _, writer, _ in idle:
+                writer.close()
+        self._idle.clear()
+
+    async def get(self, url: str, headers: dict) -> 'Response':
+        for _ in range(MAX_REDIRECTS + 1):
+            response = await self._request('GET', url, headers)
+            location = response.headers.get('Location')
+            if response.status_code not in REDIRECT_STATUS_CODES or not location:
+                return response
+
+            # Read the (usually tiny) body, so that the connection can be reused.
+            while await response.read(64 * 1024):
+                pass
+            url = urllib.parse.urljoin(url, location)
+            log.debug('Following redirect to %s', url)
+
+        raise requests.exceptions.TooManyRedirects('Exceeded %d redirects.' % MAX_REDIRECTS)
+
+    async def _request(self, method: str, url: str, headers: dict) -> 'Response':
+        parts = urllib.parse.urlsplit(url)
+        default_port = 443 if parts.scheme == 'https' else 80
+        key = (parts.scheme, parts.hostname, parts.port or default_port)
+
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+        lines = ['%s %s HTTP/1.1' % (method, target),
+                 'Host: %s' % parts.netloc,
+                 # Content-Encoding is not supported, we write the body as-is.
+                 'Accept-Encoding: identity',
+                 'Connection: keep-alive']
+        lines.extend('%s: %s' % item for item in headers.items())
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+        while True:
+            reader, writer, reused = await self._connection(key)
+            try:
+                writer.write(request)
+                await _with_timeout(writer.drain())
+                status_line, response_headers = await self._read_head(reader)
+            except (requests.exceptions.ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused:
+                    # The server closed the idle connection, try again with a new one.
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            break
+
+        return Response(self, key, url, reader, writer, status_line, response_headers)
+
+    async def _connection(self, key: tuple):
+        """Returns (reader, writer, reused) for a new or idle connection."""
+
+        idle = self._idle.get(key)
+        now = time.monotonic()
+        while idle:
+            reader, writer, idle_since = idle.pop()
+            if (now - idle_since < IDLE_TIMEOUT_SECS
+                    and not reader.at_eof() and not writer.is_closing()):
+                return reader, writer, True
+            writer.close()
+
+        scheme, host, port = key
+        ssl_context = self._get_ssl_context() if scheme == 'https' else None
+        reader, writer = await _with_timeout(asyncio.open_connection(host, port, ssl=ssl_context),
+                                             CONNECT_TIMEOUT_SECS)
+        return reader, writer, False
+
+    def _get_ssl_context(self) -> ssl.SSLContext:
+        if self._ssl_context is None:
+            # Use the same certificates as Requests does.
+            self._ssl_context = ssl.create_default_context(cafile=requests.certs.where())
+        return self._ssl_context
+
+    def _release(self, key: tuple, reader, writer):
+        """Keeps the connection for reuse, if there is room in the pool."""
+
+        idle = self._idle[key]
+        if len(idle) >= self.max_idle_per_host or writer.is_closing():
+            writer.close()
+            return
+        idle.append((reader, writer, time.monotonic()))
+
+    @staticmethod
+    async def _read_head(reader):
+        """Reads the status line and headers of a response."""
+
+        status_line = await _with_timeout(reader.readline())
+        if not status_line:
+            raise requests.exceptions.ConnectionError('Connection closed by server')
+
+        headers = requests.structures.CaseInsensitiveDict()
+        while True:
+            line = await _with_timeout(reader.readline())
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name = name.strip()
+            value = value.strip()
+            if name in headers:
+                headers[name] = '%s, %s' % (headers[name], value)
+            else:
+                headers[name] = value
+
+        return status_line.decode('latin-1'), headers
+
+
+class Response:
+    """HTTP response, with the same attributes as a Requests response where possible."""
+
+    def __init__(self, pool: ConnectionPool, key: tuple, url: str,
+                 reader, writer, status_line: str, headers):
+        version, status, *reason = status_line.split(None, 2)
+        self.url = url
+        self.status_code = int(status)
+        self.reason = reason[0].strip() if reason else ''
+        self.headers = headers
+
+        self._pool = pool
+        self._key = key
+        self._reader = reader
+        self._writer = writer
+        self._done = False
+        self._keep_alive = (version == 'HTTP/1.1'
+                            and headers.get('Connection', '').lower() != 'close')
+
+        self._chunked = False
+        self._chunk_left = 0
+        self._remaining = None  # Bytes left in the body, or None if unknown.
+        if self.status_code in NO_BODY_STATUS_CODES:
+            self._remaining = 0
+        elif 'chunked' in headers.get('Transfer-Encoding', '').lower():
+            self._chunked = True
+        elif 'Content-Length' in headers:
+            self._remaining = int(headers['Content-Length'])
+        else:
+            # The body ends when the server closes the connection.
+            self._keep_alive = False
+
+        if self._remaining == 0:
+            self._finish()
+
+    def __repr__(self):
+        return '<%s [%d]>' % (type(self).__name__, self.status_code)
+
+    def raise_for_status(self):
+        if 400 <= self.status_code < 600:
+            raise requests.exceptions.HTTPError(
+                '%d %s for url: %s' % (self.status_code, self.reason, self.url), response=self)
+
+    async def read(self, size: int) -> bytes:
+        """Reads at most 'size' bytes of the body; returns b'' at the end of the body."""
+
+        if self._done:
+            return b''
+
+        try:
+            if self._chunked:
+                return await self._read_chunked(size)
+
+            if self._remaining is None:
+                data = await _with_timeout(self._reader.read(size))
+                if not data:
+                    self._finish()
+                return data
+
+            data = await _with_timeout(self._reader.read(min(size, self._remaining)))
+            if not data:
+                raise requests.exceptions.ConnectionError(
+                    'Connection closed with %d bytes of the body left' % self._remaining)
+            self._remaining -= len(data)
+            if not self._remaining:
+                self._finish()
+            return data
+        except BaseException:
+            self.close()
+            raise
+
+    async def _read_chunked(self, size: int) -> bytes:
+        if not self._chunk_left:
+            line = await _with_timeout(self._reader.readline())
+            self._chunk_left = int(line.split(b';', 1)[0].strip(), 16)
+            if not self._chunk_left:
+                # Last chunk, skip the trailer.
+                while await _with_timeout(self._reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                self._finish()
+                return b''
+
+        data = await _with_timeout(self._reader.read(min(size, self._chunk_left)))
+        if not data:
+            raise requests.exceptions.ConnectionError('Connection closed in the middle of a chunk')
+        self._chunk_left -= len(data)
+        if not self._chunk_left:
+            await _with_timeout(self._reader.readexactly(2))  # CRLF after the chunk.
+        return data
+
+    def _finish(self):
+        self._done = True
+        if self._keep_alive:
+            self._pool._release(self._key, self._reader, self._writer)
+        else:
+            self._writer.close()
+
+    def close(self):
+        """Closes the response; the connection is dropped if the body wasn't read completely."""
+
+        if self._done:
+            return
+        self._done = True
+        self._writer.close()
@@ -48,14 +48,24 @@ def setup_asyncio_executor():
     else:
         loop = asyncio.get_event_loop()
 
-    executor = concurrent.futures.ThreadPoolExecutor(max_workers=10)
+    from . import limiter, pillar
+
+    # The number of simultaneous Pillar calls and downloads adapts to the server's
+    # responses, between 1 and the maximum.
+    pillar.pillar_limiter = limiter.AdaptiveLimiter(
+        'Pillar API', 3, max_limit=pillar.MAX_CONCURRENT_API_CALLS)
+    pillar.download_limiter = limiter.AdaptiveLimiter(
+        'downloads', 4, max_limit=pillar.MAX_CONCURRENT_DOWNLOADS)
+
+    # Each call and download runs on a thread of the executor, so make sure there
+    # are enough threads to reach the limits. Ranged downloads use a thread per part,
+    # and shouldn't be able to starve the API calls.
+    max_workers = (pillar.MAX_CONCURRENT_API_CALLS
+                   + pillar.MAX_CONCURRENT_DOWNLOADS * pillar.RANGED_DOWNLOAD_PARTS)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
     loop.set_default_executor(executor)
     # loop.set_debug(True)
 
-    from . import pillar
-    # No more than this many Pillar calls should be made simultaneously
-    pillar.pillar_semaphore = asyncio.Semaphore(3, loop=loop)
-
 
 def kick_async_loop(*args) -> bool:
     """Performs a single iteration of the asyncio event loop.
@@ -19,15 +19,35 @@
 # (c) 2009, At Mind B.V. - Jeroen Bakker
 # (c) 2014, Blender Foundation - Campbell Barton
 
+import array
+import collections
+import functools
+import itertools
 import gzip
+import hashlib
 import logging
+import mmap
 import os
+import pickle
 import struct
+import sys
 import tempfile
+import zlib
 
 log = logging.getLogger("blendfile")
 
 FILE_BUFFER_SIZE = 1024 * 1024
+# Number of bytes at the end of the file in which to look for the DNA1 block.
+DNA_TAIL_SIZE = 4 * 1024 * 1024
+
+# Decoded DNA catalogues are cached, keyed by a hash of the DNA1 block.
+# Bump the version whenever the pickled classes change.
+DNA_CACHE_VERSION = 3
+DNA_CACHE_MAX_MEMORY = 8
+DNA_CACHE_MAX_FILES = 32
+# Directory to store decoded catalogues in; only cached in memory when None.
+dna_cache_directory = None
+_dna_cache = collections.OrderedDict()  # {key: (structs, sdna_index_from_id)}
 
 
 # -----------------------------------------------------------------------------
@@ -37,21 +57,49 @@ FILE_BUFFER_SIZE = 1024 * 1024
 # open a filename
 # determine if the file is compressed
 # and returns a handle
-def open_blend(filename, access="rb"):
+def open_blend(filename, access="rb", use_mmap=False, lazy=False, load_codes=None):
     """Opens a blend file for reading or writing pending on the access
     supports 2 kind of blend files. Uncompressed and compressed.
     Known issue: does not support packaged blend files
+
+    When use_mmap=True and the file is opened read-only, the file is
+    memory-mapped and all reads are done on the mapped buffer instead of
+    through the file handle. Writable files always use the handle.
+
+    When lazy=True, block headers are only read when they are needed, for
+    example by find_first_block_from_code(). Until all blocks are scanned,
+    the 'blocks' list only contains the blocks found so far.
+
+    When load_codes is given (a set of block codes) and the file is gzipped,
+    the file is not decompressed to a temporary file. Instead the blocks are
+    read straight from the gzip stream, and only the data of blocks with
+    those codes is kept in memory. Changes to those blocks are spliced into
+    the recompressed file when it is closed.
     """
     handle = open(filename, access)
     magic_test = b"BLENDER"
     magic = handle.read(len(magic_test))
+    use_mmap = use_mmap and access == "rb"
     if magic == magic_test:
         log.debug("normal blendfile detected")
         handle.seek(0, os.SEEK_SET)
-        bfile = BlendFile(handle)
+        bfile = BlendFile(handle, mmap_handle(handle) if use_mmap else None, lazy)
         bfile.is_compressed = False
         bfile.filepath_orig = filename
         return bfile
+    elif magic[:2] == b'\x1f\x8b' and load_codes is not None:
+        log.debug("gzip blendfile detected, streaming")
+        handle.close()
+        handle = gzip.open(filename, "rb")
+        magic = handle.read(len(magic_test))
+        if magic != magic_test:
+            handle.close()
+            raise Exception("filetype inside gzip not a blend")
+        handle.seek(0, os.SEEK_SET)
+        bfile = BlendFile(handle, lazy=lazy, load_codes=load_codes, read_only=(access == "rb"))
+        bfile.is_compressed = True
+        bfile.filepath_orig = filename
+        return bfile
     elif magic[:2] == b'\x1f\x8b':
         log.debug("gzip blendfile detected")
         handle.close()
@@ -68,7 +116,7 @@ def open_blend(filename, access="rb"):
             fs.close()
             log.debug("resetting decompressed file")
             handle.seek(os.SEEK_SET, 0)
-            bfile = BlendFile(handle)
+            bfile = BlendFile(handle, mmap_handle(handle) if use_mmap else None, lazy)
             bfile.is_compressed = True
             bfile.filepath_orig = filename
             return bfile
@@ -78,10 +126,166 @@ def open_blend(filename, access="rb"):
         raise Exception("filetype not a blend or a gzip blend")
 
 
+def mmap_handle(handle):
+    """Memory-maps the entire file for reading."""
+    handle.flush()
+    return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def dna_cache_path(key):
+    return os.path.join(dna_cache_directory, 'dna-v%d-%s.pickle' % (DNA_CACHE_VERSION, key))
+
+
+def dna_cache_load(key):
+    """Loads a decoded DNA catalogue from disk, returns None if not cached."""
+    if dna_cache_directory is None:
+        return None
+
+    path = dna_cache_path(key)
+    try:
+        with open(path, 'rb') as infile:
+            version, catalogue = pickle.load(infile)
+        if version != DNA_CACHE_VERSION:
+            return None
+        # Mark as recently used, for eviction.
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    except Exception as ex:
+        log.warning("unable to load cached DNA from %s: %s", path, ex)
+        return None
+
+    log.debug("loaded cached DNA from %s", path)
+    return catalogue
+
+
+def dna_cache_save(key, catalogue):
+    """Saves a decoded DNA catalogue to disk, and evicts the least recently used ones."""
+    if dna_cache_directory is None:
+        return
+
+    path = dna_cache_path(key)
+    temp_path = '%s~%d' % (path, os.getpid())
+    try:
+        os.makedirs(dna_cache_directory, exist_ok=True)
+        with open(temp_path, 'wb') as outfile:
+            pickle.dump((DNA_CACHE_VERSION, catalogue), outfile, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+    except Exception as ex:
+        log.warning("unable to save DNA cache to %s: %s", path, ex)
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        return
+
+    dna_cache_evict()
+
+
+def dna_cache_evict():
+    """Removes cached catalogues of other versions, and the least recently used ones."""
+    current_prefix = 'dna-v%d-' % DNA_CACHE_VERSION
+    current = []
+    to_remove = []
+    for entry in os.scandir(dna_cache_directory):
+        if not (entry.name.startswith('dna-v') and entry.name.endswith('.pickle')):
+            continue
+        if entry.name.startswith(current_prefix):
+            current.append((entry.stat().st_mtime, entry.path))
+        else:
+            to_remove.append(entry.path)
+
+    current.sort(reverse=True)
+    to_remove.extend(path for _, path in current[DNA_CACHE_MAX_FILES:])
+    for path in to_remove:
+        log.debug("evicting cached DNA %s", path)
+        try:
+            os.unlink(path)
+        except OSError as ex:
+            log.debug("unable to remove %s: %s", path, ex)
+
+
+def copy_stream(infile, outfile, length=None):
+    """Copies length bytes (or everything when None) from infile to outfile."""
+    while length is None or length > 0:
+        data = infile.read(FILE_BUFFER_SIZE if length is None else min(length, FILE_BUFFER_SIZE))
+        if not data:
+            if length is not None:
+                raise EOFError("unexpected end of file, %d bytes left to copy" % length)
+            break
+        outfile.write(data)
+        if length is not None:
+            length -= len(data)
+
+
 def pad_up_4(offset):
     return (offset + 3) & ~3
 
 
+# Summary of a single blend file, as produced by scan_many().
+#   filepath: the path as passed to scan_many()
+#   block_counts: {block code: number of blocks}
+#   paths: {block code: [path, ...]} of the blocks with the requested codes
+#   error: None, or a description of why the file couldn't be scanned
+BlendFileSummary = collections.namedtuple(
+    'BlendFileSummary', ['filepath', 'block_counts', 'paths', 'error'])
+
+# Fields that hold the file path of library and image blocks; the first one
+# that exists is used. Blender 2.93 renamed 'name' to 'filepath'.
+SUMMARY_PATH_FIELDS = (b'name', b'filepath')
+
+
+def scan_many(filepaths, codes=(b'LI', b'IM'), max_workers=None):
+    """Scans many blend files in parallel, using a pool of processes.
+
+    Yields a BlendFileSummary per file, in order of completion. Files that
+    can't be read are reported through the summary's 'error' field, so one
+    broken file doesn't stop the scan.
+    """
+    import concurrent.futures
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_scan_worker_init,
+            initargs=(dna_cache_directory,)) as executor:
+        futures = [executor.submit(scan_summary, filepath, codes) for filepath in filepaths]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result()
+        finally:
+            # Don't wait for files nobody is interested in any more.
+            for future in futures:
+                future.cancel()
+
+
+def _scan_worker_init(cache_directory):
+    global dna_cache_directory
+    dna_cache_directory = cache_directory
+
+
+def scan_summary(filepath, codes=(b'LI', b'IM')):
+    """Returns a BlendFileSummary of a single blend file."""
+    try:
+        # Plain files are memory-mapped, gzipped files are streamed.
+        with open_blend(filepath, 'rb', use_mmap=True, load_codes=set(codes)) as bfile:
+            block_counts = collections.Counter(
+                block.code for block in bfile.blocks if block.code != b'ENDB')
+            paths = {code: [summary_path(block) for block in bfile.find_blocks_from_code(code)]
+                     for code in codes}
+    except Exception as ex:
+        log.debug("unable to scan %s: %s", filepath, ex)
+        return BlendFileSummary(filepath, {}, {}, '%s: %s' % (type(ex).__name__, ex))
+
+    return BlendFileSummary(filepath, dict(block_counts), paths, None)
+
+
+def summary_path(block):
+    """Returns the file path of a block as bytes, or None if it has none."""
+    for field in SUMMARY_PATH_FIELDS:
+        path = block.get(field, default=None, use_str=False)
+        if path is not None:
+            return path
+    return None
+
+
 # -----------------------------------------------------------------------------
 # module classes
 
@@ -100,6 +304,7 @@ class BlendFile:
         # struct.Struct
         "block_header_struct",
         # BlendFileBlock
+        # (when lazy, only the blocks that have been scanned so far)
         "blocks",
         # [DNAStruct, ...]
         "structs",
@@ -107,6 +312,7 @@ class BlendFile:
         # (where the index is an index into 'structs')
         "sdna_index_from_id",
         # dict {addr_old: block}
+        # (None until find_block_from_offset() is first called)
         "block_from_offset",
         # int
         "code_index",
@@ -114,34 +320,45 @@ class BlendFile:
         "is_modified",
         # bool (is file gzipped)
         "is_compressed",
+        # mmap.mmap (or None when reading through the handle)
+        "mmap",
+        # memoryview of the entire file (or None when reading through the handle)
+        "data",
+        # int, file offset of the next block header to scan
+        # (None when all blocks have been scanned)
+        "next_block_offset",
+        # set of block codes whose data is loaded into memory while scanning
+        # (when streaming from a gzipped file), or None
+        "load_codes",
+        # bool (loaded block data can't be changed)
+        "read_only",
+        # BlendFilePointerGraph (None until get_pointer_graph() is first called)
+        "pointer_graph",
         )
 
-    def __init__(self, handle):
+    def __init__(self, handle, mmapped=None, lazy=False, load_codes=None, read_only=False):
         log.debug("initializing reading blend-file")
         self.handle = handle
+        self.mmap = mmapped
+        self.data = memoryview(mmapped) if mmapped is not None else None
         self.header = BlendFileHeader(handle)
         self.block_header_struct = self.header.create_block_header_struct()
         self.blocks = []
         self.code_index = {}
-
-        block = BlendFileBlock(handle, self)
-        while block.code != b'ENDB':
-            if block.code == b'DNA1':
-                (self.structs,
-                 self.sdna_index_from_id,
-                 ) = BlendFile.decode_structs(self.header, block, handle)
-            else:
-                handle.seek(block.size, os.SEEK_CUR)
-
-            self.blocks.append(block)
-            self.code_index.setdefault(block.code, []).append(block)
-
-            block = BlendFileBlock(handle, self)
+        self.block_from_offset = None
+        self.structs = None
+        self.sdna_index_from_id = None
         self.is_modified = False
-        self.blocks.append(block)
+        self.next_block_offset = handle.tell()
+        self.load_codes = load_codes
+        self.read_only = read_only
+        self.pointer_graph = None
 
-        # cache (could lazy init, incase we never use?)
-        self.block_from_offset = {block.addr_old: block for block in self.blocks if block.code != b'ENDB'}
+        # When lazy, only the DNA is loaded now, and blocks are scanned on demand.
+        # A gzip stream can't be searched from the end, though.
+        if lazy and load_codes is None and self.decode_structs_from_tail():
+            return
+        self.scan_all_blocks()
 
     def __enter__(self):
         return self
@@ -149,18 +366,117 @@ class BlendFile:
     def __exit__(self, type, value, traceback):
         self.close()
 
+    def scan_next_block(self):
+        """
+        Read the header of the next block, and add it to the block index.
+        Return None when all blocks have been scanned.
+        """
+        offset = self.next_block_offset
+        if offset is None:
+            return None
+
+        if self.data is None:
+            self.handle.seek(offset, os.SEEK_SET)
+        block = BlendFileBlock(self.handle, self, offset)
+        self.blocks.append(block)
+
+        if block.code == b'ENDB':
+            self.next_block_offset = None
+            return block
+
+        if block.code == b'DNA1' and self.structs is None:
+            (self.structs,
+             self.sdna_index_from_id,
+             ) = BlendFile.decode_structs_cached(self.header, block.get_raw_data())
+        elif self.load_codes is not None and block.code in self.load_codes:
+            data = block.get_raw_data()
+            block.data = data if self.read_only else bytearray(data)
+
+        self.code_index.setdefault(block.code, []).append(block)
+        self.next_block_offset = block.file_offset + block.size
+        return block
+
+    def scan_all_blocks(self):
+        while self.scan_next_block() is not None:
+            pass
+
+    def decode_structs_from_tail(self):
+        """
+        Blender writes the DNA1 block just before the ENDB block, so it can
+        be found without scanning the whole file. Return True when found.
+        """
+        header_size = self.block_header_struct.size
+        if self.data is not None:
+            tail_offset = max(0, len(self.data) - DNA_TAIL_SIZE)
+            tail = self.data[tail_offset:].tobytes()
+        else:
+            file_size = self.handle.seek(0, os.SEEK_END)
+            tail_offset = max(0, file_size - DNA_TAIL_SIZE)
+            self.handle.seek(tail_offset, os.SEEK_SET)
+            tail = self.handle.read()
+
+        index = tail.rfind(b'SDNANAME')
+        while index != -1:
+            # This may also have been found in some other data block, so check
+            # that it really is a DNA1 header followed by the ENDB block.
+            block_index = index - header_size
+            if block_index >= 0 and tail.startswith(b'DNA1', block_index):
+                size = self.block_header_struct.unpack_from(tail, block_index)[1]
+                data_index = block_index + header_size
+                if tail.startswith(b'ENDB', data_index + size):
+                    (self.structs,
+                     self.sdna_index_from_id,
+                     ) = BlendFile.decode_structs_cached(self.header,
+                                                         tail[data_index:data_index + size])
+                    return True
+            index = tail.rfind(b'SDNANAME', 0, index)
+
+        log.debug("DNA1 block not found at end of file, scanning all blocks")
+        return False
+
     def find_blocks_from_code(self, code):
         assert(type(code) == bytes)
+        self.scan_all_blocks()
         if code not in self.code_index:
             return []
         return self.code_index[code]
 
+    def find_first_block_from_code(self, code):
+        """
+        Return the first block with this code, or None if there is no such block.
+        Only scans as many block headers as needed to find it.
+        """
+        assert(type(code) == bytes)
+        blocks = self.code_index.get(code)
+        if blocks:
+            return blocks[0]
+
+        block = self.scan_next_block()
+        while block is not None:
+            if block.code == code:
+                return block
+            block = self.scan_next_block()
+        return None
+
     def find_block_from_offset(self, offset):
         # same as looking looping over all blocks,
         # then checking ``block.addr_old == offset``
         assert(type(offset) is int)
+        if self.block_from_offset is None:
+            self.scan_all_blocks()
+            self.block_from_offset = {block.addr_old: block for block in self.blocks
+                                      if block.code != b'ENDB'}
         return self.block_from_offset.get(offset)
 
+    def get_pointer_graph(self):
+        """
+        Return the index of pointers between blocks, building it on first use.
+        Pointers changed after that aren't reflected in the index.
+        """
+        if self.pointer_graph is None:
+            self.pointer_graph = BlendFilePointerGraph(self)
+        return self.pointer_graph
+
     def close(self):
         """
         Close the blend file
@@ -168,7 +484,10 @@ class BlendFile:
         """
         handle = self.handle
 
-        if self.is_modified:
+        if self.is_modified and self.load_codes is not None:
+            handle.close()
+            self.write_loaded_blocks()
+        elif self.is_modified:
             if self.is_compressed:
                 log.debug("close compressed blend file")
                 handle.seek(os.SEEK_SET, 0)
@@ -181,8 +500,39 @@ class BlendFile:
                 fs.close()
                 log.debug("compressing finished")
 
+        if self.data is not None:
+            self.data.release()
+            self.data = None
+            self.mmap.close()
+            self.mmap = None
         handle.close()
 
+    def write_loaded_blocks(self):
+        """
+        Recompress the streamed file, replacing the data of the blocks that
+        were loaded into memory.
+        """
+        loaded_blocks = sorted((block for block in self.blocks if block.data is not None),
+                               key=lambda block: block.file_offset)
+        temp_path = '%s~%d' % (self.filepath_orig, os.getpid())
+
+        log.debug("recompressing %s with %d loaded blocks", self.filepath_orig, len(loaded_blocks))
+        try:
+            with gzip.open(self.filepath_orig, "rb") as infile, gzip.open(temp_path, "wb") as outfile:
+                offset = 0
+                for block in loaded_blocks:
+                    copy_stream(infile, outfile, block.file_offset - offset)
+                    infile.seek(block.size, os.SEEK_CUR)
+                    outfile.write(block.data)
+                    offset = block.file_offset + block.size
+                copy_stream(infile, outfile)
+            os.replace(temp_path, self.filepath_orig)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        log.debug("recompressing finished")
+
     def ensure_subtype_smaller(self, sdna_index_curr, sdna_index_next):
         # never refine to a smaller type
         if (self.structs[sdna_index_curr].size >
@@ -193,7 +543,32 @@ class BlendFile:
                                 self.structs[sdna_index_next].dna_type_id.decode('ascii')))
 
     @staticmethod
-    def decode_structs(header, block, handle):
+    def decode_structs_cached(header, data):
+        """
+        Same as decode_structs(), but reuses earlier decoded catalogues.
+        The DNA of a Blender build is the same for all the files it writes.
+        """
+        key = hashlib.sha1(b'%s%d' % (header.endian_str, header.pointer_size))
+        key.update(data)
+        key = key.hexdigest()
+
+        catalogue = _dna_cache.get(key)
+        if catalogue is not None:
+            _dna_cache.move_to_end(key)
+            return catalogue
+
+        catalogue = dna_cache_load(key)
+        if catalogue is None:
+            catalogue = BlendFile.decode_structs(header, data)
+            dna_cache_save(key, catalogue)
+
+        _dna_cache[key] = catalogue
+        while len(_dna_cache) > DNA_CACHE_MAX_MEMORY:
+            _dna_cache.popitem(last=False)
+        return catalogue
+
+    @staticmethod
+    def decode_structs(header, data):
         """
         DNACatalog is a catalog of all information in the DNA1 file-block
         """
@@ -202,7 +577,6 @@ class BlendFile:
         shortstruct2 = struct.Struct(header.endian_str + b'HH')
         intstruct = DNA_IO.UINT[header.endian_index]
 
-        data = handle.read(block.size)
         types = []
         names = []
 
@@ -269,7 +643,8 @@ class BlendFile:
                 else:
                     dna_size = dna_type.size * dna_name.array_size
 
-                field = DNAField(dna_type, dna_name, dna_size, dna_offset)
+                codec = DNA_IO.create_codec(header, dna_type, dna_name)
+                field = DNAField(dna_type, dna_name, dna_size, dna_offset, codec)
                 dna_struct.fields.append(field)
                 dna_struct.field_from_name[dna_name.name_only] = field
                 dna_offset += dna_size
@@ -291,6 +666,9 @@ class BlendFileBlock:
         "count",
         "file_offset",
         "user_data",
+        # bytearray (or bytes when read-only) with the data of this block,
+        # when loaded into memory from a streamed file, otherwise None
+        "data",
         )
 
     def __str__(self):
@@ -304,13 +682,24 @@ class BlendFileBlock:
                  hex(self.addr_old),
                  ))
 
-    def __init__(self, handle, bfile):
+    def __init__(self, handle, bfile, offset=None):
+        """Reads the block header.
+
+        The header is read from the handle's current position, or, when the
+        file is memory-mapped, from the buffer at the given file offset.
+        """
         OLDBLOCK = struct.Struct(b'4sI')
 
         self.file = bfile
         self.user_data = None
+        self.data = None
 
-        data = handle.read(bfile.block_header_struct.size)
+        if bfile.data is None:
+            data = handle.read(bfile.block_header_struct.size)
+            data_offset = None
+        else:
+            data = bfile.data[offset:offset + bfile.block_header_struct.size]
+            data_offset = offset + len(data)
         # header size can be 8, 20, or 24 bytes long
         # 8: old blend files ENDB block (exception)
         # 20: normal headers 32 bit platform
@@ -324,7 +713,7 @@ class BlendFileBlock:
                 self.addr_old = blockheader[2]
                 self.sdna_index = blockheader[3]
                 self.count = blockheader[4]
-                self.file_offset = handle.tell()
+                self.file_offset = handle.tell() if data_offset is None else data_offset
             else:
                 self.size = 0
                 self.addr_old = 0
@@ -355,6 +744,27 @@ class BlendFileBlock:
         assert(type(dna_type_id) is bytes)
         self.refine_type_from_index(self.file.sdna_index_from_id[dna_type_id])
 
+    def get_buffer(self):
+        """
+        Return (buffer, offset) when the data of this block is available in
+        memory, where offset is the start of the block in the buffer,
+        or (None, file_offset) when it has to be read through the file handle.
+        """
+        if self.data is not None:
+            return self.data, 0
+        return self.file.data, self.file_offset
+
+    def get_raw_data(self):
+        """
+        Return the data of this block as bytes
+        """
+        data, ofs = self.get_buffer()
+        if data is not None:
+            return bytes(data[ofs:ofs + self.size])
+
+        self.file.handle.seek(ofs, os.SEEK_SET)
+        return self.file.handle.read(self.size)
+
     def get_file_offset(self, path,
             default=...,
             sdna_index_refine=None,
@@ -369,7 +779,6 @@ class BlendFileBlock:
         if base_index != 0:
             assert(base_index < self.count)
             ofs += (self.size // self.count) * base_index
-        self.file.handle.seek(ofs, os.SEEK_SET)
 
         if sdna_index_refine is None:
             sdna_index_refine = self.sdna_index
@@ -377,10 +786,10 @@ class BlendFileBlock:
             self.file.ensure_subtype_smaller(self.sdna_index, sdna_index_refine)
 
         dna_struct = self.file.structs[sdna_index_refine]
-        field = dna_struct.field_from_path(
-                self.file.header, self.file.handle, path)
+        field, field_offset = dna_struct.field_offset_from_path(
+                self.file.header, path)
 
-        return (self.file.handle.tell(), field.dna_name.array_size)
+        return (ofs + field_offset, field.dna_name.array_size)
 
     def get(self, path,
             default=...,
@@ -389,11 +798,10 @@ class BlendFileBlock:
             base_index=0,
             ):
 
-        ofs = self.file_offset
+        data, ofs = self.get_buffer()
         if base_index != 0:
             assert(base_index < self.count)
             ofs += (self.size // self.count) * base_index
-        self.file.handle.seek(ofs, os.SEEK_SET)
 
         if sdna_index_refine is None:
             sdna_index_refine = self.sdna_index
@@ -401,10 +809,18 @@ class BlendFileBlock:
             self.file.ensure_subtype_smaller(self.sdna_index, sdna_index_refine)
 
         dna_struct = self.file.structs[sdna_index_refine]
+        if data is not None:
+            return dna_struct.field_get_from_data(
+                    self.file.header, data, ofs, path,
+                    default=default,
+                    use_nil=use_nil, use_str=use_str,
+                    )
+
         return dna_struct.field_get(
                 self.file.header, self.file.handle, path,
                 default=default,
                 use_nil=use_nil, use_str=use_str,
+                offset=ofs,
                 )
 
     def get_recursive_iter(self, path, path_root=b"",
@@ -437,38 +853,145 @@ class BlendFileBlock:
         for k in self.keys():
             yield from self.get_recursive_iter(k, use_str=False)
 
+    def decode(self, base_index=0, sdna_index_refine=None):
+        """
+        Decode the entire struct in one go, returning a DNARecord.
+        Nested structs are decoded as nested records.
+        """
+        if sdna_index_refine is None:
+            sdna_index_refine = self.sdna_index
+        else:
+            self.file.ensure_subtype_smaller(self.sdna_index, sdna_index_refine)
+        decoder = self.file.structs[sdna_index_refine].get_decoder(self.file.header)
+
+        data, ofs = self.get_buffer()
+        if base_index != 0:
+            assert(base_index < self.count)
+            ofs += (self.size // self.count) * base_index
+
+        if data is not None:
+            return decoder.decode(data, ofs)
+
+        self.file.handle.seek(ofs, os.SEEK_SET)
+        return decoder.decode(self.file.handle.read(decoder.codec.size), 0)
+
+    def decode_all(self):
+        """
+        Decode all 'count' struct instances of this block, returning a list of DNARecords.
+        """
+        decoder = self.dna_type.get_decoder(self.file.header)
+        data, ofs = self.get_buffer()
+        if data is None:
+            data = self.get_raw_data()
+            ofs = 0
+
+        stride = self.size // self.count if self.count else 0
+        return [decoder.decode(data, ofs + stride * index)
+                for index in range(self.count)]
+
     def get_data_hash(self):
         """
         Generates a 'hash' that can be used instead of addr_old as block id, and that should be 'stable' across .blend
         file load & save (i.e. it does not changes due to pointer addresses variations).
+
+        The hash is computed over the raw block data, skipping the bytes of pointer fields.
         """
-        # TODO This implementation is most likely far from optimal... and CRC32 is not renown as the best hashing
-        #      algo either. But for now does the job!
-        import zlib
-        def _is_pointer(self, k):
-            return self.file.structs[self.sdna_index].field_from_path(
-                    self.file.header, self.file.handle, k).dna_name.is_pointer
+        data = memoryview(self.get_raw_data())
+        dna_struct = self.file.structs[self.sdna_index]
+        data_ranges = dna_struct.get_data_ranges()
+        struct_size = dna_struct.size
 
         hsh = 1
-        for k, v in self.items_recursive_iter():
-            if not _is_pointer(self, k):
-                hsh = zlib.adler32(str(v).encode(), hsh)
-        return hsh
+        if struct_size == 0 or data_ranges == ((0, struct_size),):
+            # No pointers to skip, so hash the block in one go.
+            return zlib.adler32(data, hsh)
+
+        # Only mask complete struct instances; trailing bytes are hashed as-is.
+        element_count = min(self.count, len(data) // struct_size)
+        for element_offset in range(0, element_count * struct_size, struct_size):
+            for start, end in data_ranges:
+                hsh = zlib.adler32(data[element_offset + start:element_offset + end], hsh)
+        return zlib.adler32(data[element_count * struct_size:], hsh)
 
     def set(self, path, value,
             sdna_index_refine=None,
             ):
 
+        if self.file.read_only:
+            raise PermissionError("blend file opened read-only")
+
         if sdna_index_refine is None:
             sdna_index_refine = self.sdna_index
         else:
             self.file.ensure_subtype_smaller(self.sdna_index, sdna_index_refine)
 
         dna_struct = self.file.structs[sdna_index_refine]
-        self.file.handle.seek(self.file_offset, os.SEEK_SET)
+        data, ofs = self.get_buffer()
+        if data is not None:
+            dna_struct.field_set_in_data(self.file.header, data, ofs, path, value)
+            self.file.is_modified = True
+            return
+
         self.file.is_modified = True
         return dna_struct.field_set(
-                self.file.header, self.file.handle, path, value)
+                self.file.header, self.file.handle, path, value, offset=ofs)
+
+    def set_many(self, values,
+                 sdna_index_refine=None,
+                 ):
+        """
+        Set multiple fields at once, from a {path: value} mapping.
+
+        All fields are resolved and encoded before anything is written, so
+        an unknown path or unsupported value leaves the block untouched.
+        The writes are sorted by offset and written in a single pass.
+        """
+        if self.file.read_only:
+            raise PermissionError("blend file opened read-only")
+
+        if sdna_index_refine is None:
+            sdna_index_refine = self.sdna_index
+        else:
+            self.file.ensure_subtype_smaller(self.sdna_index, sdna_index_refine)
+
+        dna_struct = self.file.structs[sdna_index_refine]
+        header = self.file.header
+
+        writes = []
+        for path, value in values.items():
+            field, field_offset = dna_struct.field_offset_from_path(header, path)
+            if field is None:
+                raise KeyError("%r not found in %r" %
+                        (path, [f.dna_name.name_only for f in dna_struct.fields]))
+            writes.append((field_offset, dna_struct.field_encode(header, field, value)))
+        if not writes:
+            return
+        writes.sort(key=lambda write: write[0])
+
+        data, ofs = self.get_buffer()
+        if data is not None:
+            for field_offset, encoded in writes:
+                start = ofs + field_offset
+                data[start:start + len(encoded)] = encoded
+            self.file.is_modified = True
+            return
+
+        # Read the span covering all fields, patch it, and write it back in one go.
+        span_start = writes[0][0]
+        span_end = max(field_offset + len(encoded) for field_offset, encoded in writes)
+        handle = self.file.handle
+        if len(writes) == 1:
+            span = writes[0][1]
+        else:
+            handle.seek(ofs + span_start, os.SEEK_SET)
+            span = bytearray(handle.read(span_end - span_start))
+            for field_offset, encoded in writes:
+                start = field_offset - span_start
+                span[start:start + len(encoded)] = encoded
+
+        handle.seek(ofs + span_start, os.SEEK_SET)
+        handle.write(span)
+        self.file.is_modified = True
 
     # ---------------
     # Utility get/set
@@ -488,8 +1011,8 @@ class BlendFileBlock:
         if type(result) is not int:
             return result
 
-        assert(self.file.structs[sdna_index_refine].field_from_path(
-                self.file.header, self.file.handle, path).dna_name.is_pointer)
+        # The path was resolved (and cached) by get() above.
+        assert(self.file.structs[sdna_index_refine].path_cache[path][0].dna_name.is_pointer)
         if result != 0:
             # possible (but unlikely)
             # that this fails and returns None
@@ -537,6 +1060,123 @@ class BlendFileBlock:
 # version = int
 
 
+class BlendFilePointerGraph:
+    """
+    Index of the pointers between the blocks of a blend file, for queries
+    like "which blocks can be reached from this one".
+
+    The edges are stored in compressed sparse row form: the blocks pointed to
+    by blocks[i] are edge_targets[edge_starts[i]:edge_starts[i + 1]], where
+    the targets are indices into 'blocks' as well.
+    """
+    __slots__ = (
+        # [BlendFileBlock, ...], the same list as BlendFile.blocks
+        "blocks",
+        # dict {file_offset: index into 'blocks'}
+        "index_from_file_offset",
+        # array.array of int, len(blocks) + 1 items
+        "edge_starts",
+        # array.array of int, indices into 'blocks'
+        "edge_targets",
+        )
+
+    # Blocks that don't point to other blocks, and can't be pointed to either.
+    SKIP_CODES = {b'DNA1', b'ENDB', b'REND', b'TEST'}
+
+    # Raw data blocks (without a struct type) are searched word by word for
+    # pointers to other blocks, but only up to this size.
+    RAW_SCAN_MAX_SIZE = 1 << 20
+
+    def __init__(self, bfile):
+        bfile.scan_all_blocks()
+        self.blocks = blocks = bfile.blocks
+
+        self.index_from_file_offset = {block.file_offset: index
+                                       for index, block in enumerate(blocks)}
+        index_from_addr = {block.addr_old: index
+                           for index, block in enumerate(blocks)
+                           if block.code not in self.SKIP_CODES}
+
+        self.edge_starts = array.array('q', [0])
+        self.edge_targets = array.array('i')
+        for block in blocks:
+            if block.code not in self.SKIP_CODES:
+                # dict.fromkeys() removes duplicates, but keeps the order.
+                targets = dict.fromkeys(index_from_addr[pointer]
+                                        for pointer in self.block_pointers(bfile, block)
+                                        if pointer in index_from_addr)
+                self.edge_targets.extend(targets)
+            self.edge_starts.append(len(self.edge_targets))
+
+    def block_pointers(self, bfile, block):
+        """Return an iterable of all pointer values in the block."""
+        header = bfile.header
+        dna_struct = bfile.structs[block.sdna_index]
+        struct_size = dna_struct.size
+        data = block.get_raw_data()
+
+        if block.sdna_index == 0 and struct_size * block.count != block.size:
+            # Raw data, for example an array of pointers.
+            if block.size > self.RAW_SCAN_MAX_SIZE:
+                return ()
+            words = array.array('I' if header.pointer_size == 4 else 'Q')
+            words.frombytes(data[:len(data) - len(data) % header.pointer_size])
+            if header.is_little_endian != (sys.byteorder == 'little'):
+                words.byteswap()
+            return words
+
+        codec = dna_struct.get_pointer_codec(header)
+        if codec is None:
+            return ()
+        count = min(block.count, len(data) // struct_size)
+        return itertools.chain.from_iterable(codec.iter_unpack(data[:count * struct_size]))
+
+    def targets(self, block):
+        """Return the blocks this block points to."""
+        index = self.index_from_file_offset[block.file_offset]
+        edge_targets = self.edge_targets[self.edge_starts[index]:self.edge_starts[index + 1]]
+        return [self.blocks[target] for target in edge_targets]
+
+    def reachable_indices(self, roots, depth_first=False):
+        """
+        Return the indices of all blocks reachable from the roots (including
+        the roots themselves), in breadth-first or depth-first order.
+        """
+        edge_starts = self.edge_starts
+        edge_targets = self.edge_targets
+        visited = bytearray(len(self.blocks))
+        pending = collections.deque()
+        for block in roots:
+            index = self.index_from_file_offset[block.file_offset]
+            if not visited[index]:
+                visited[index] = 1
+                pending.append(index)
+
+        pop = pending.pop if depth_first else pending.popleft
+        order = []
+        while pending:
+            index = pop()
+            order.append(index)
+            for target in edge_targets[edge_starts[index]:edge_starts[index + 1]]:
+                if not visited[target]:
+                    visited[target] = 1
+                    pending.append(target)
+        return order
+
+    def reachable_from(self, roots, depth_first=False):
+        """
+        Return all blocks reachable from the roots (an iterable of blocks),
+        including the roots themselves.
+        """
+        return [self.blocks[index] for index in self.reachable_indices(roots, depth_first)]
+
+    def unreachable(self, roots):
+        """Return all blocks that can't be reached from the roots."""
+        reachable = set(self.reachable_indices(roots))
+        return [block for index, block in enumerate(self.blocks)
+                if index not in reachable and block.code not in self.SKIP_CODES]
+
+
 class BlendFileHeader:
     """
     BlendFileHeader allocates the first 12 bytes of a blend file
@@ -667,13 +1307,25 @@ class DNAField:
         "dna_size",
         # cached info (avoid looping over fields each time)
         "dna_offset",
+        # struct.Struct to read the value with, or None if not supported
+        "codec",
         )
 
-    def __init__(self, dna_type, dna_name, dna_size, dna_offset):
+    def __init__(self, dna_type, dna_name, dna_size, dna_offset, codec=None):
         self.dna_type = dna_type
         self.dna_name = dna_name
         self.dna_size = dna_size
         self.dna_offset = dna_offset
+        self.codec = codec
+
+    # struct.Struct can't be pickled, so store its format instead.
+    def __getstate__(self):
+        return (self.dna_type, self.dna_name, self.dna_size, self.dna_offset,
+                self.codec.format if self.codec is not None else None)
+
+    def __setstate__(self, state):
+        (self.dna_type, self.dna_name, self.dna_size, self.dna_offset, codec_format) = state
+        self.codec = struct.Struct(codec_format) if codec_format is not None else None
 
 
 class DNAStruct:
@@ -686,6 +1338,19 @@ class DNAStruct:
         "fields",
         "field_from_name",
         "user_data",
+        # DNARecordDecoder (created on first use by get_decoder())
+        "decoder",
+        # ((start, end), ...) byte ranges of all non-pointer data
+        # (computed on first use by get_data_ranges())
+        "data_ranges",
+        # {path: (field, offset)} of paths resolved by field_offset_from_path()
+        "path_cache",
+        # (offset, ...) of all pointers, also those in nested structs
+        # (computed on first use by get_pointer_offsets())
+        "pointer_offsets",
+        # struct.Struct that unpacks all pointers of an instance
+        # (created on first use by get_pointer_codec())
+        "pointer_codec",
         )
 
     def __init__(self, dna_type_id):
@@ -693,17 +1358,142 @@ class DNAStruct:
         self.fields = []
         self.field_from_name = {}
         self.user_data = None
+        self.decoder = None
+        self.data_ranges = None
+        self.path_cache = {}
+        self.pointer_offsets = None
+        self.pointer_codec = None
 
     def __repr__(self):
         return '%s(%r)' % (type(self).__qualname__, self.dna_type_id)
 
-    def field_from_path(self, header, handle, path):
+    # The decoder, data ranges, path cache and pointer info are created at runtime,
+    # and aren't pickled.
+    def __getstate__(self):
+        return (self.dna_type_id, getattr(self, 'size', None), self.fields,
+                self.field_from_name, self.user_data)
+
+    def __setstate__(self, state):
+        (self.dna_type_id, self.size, self.fields,
+         self.field_from_name, self.user_data) = state
+        self.decoder = None
+        self.data_ranges = None
+        self.path_cache = {}
+        self.pointer_offsets = None
+        self.pointer_codec = None
+
+    def get_decoder(self, header):
+        if self.decoder is None:
+            self.decoder = DNARecordDecoder(header, self)
+        return self.decoder
+
+    def get_data_ranges(self):
+        """
+        Return the byte ranges of this struct that don't contain pointers,
+        as a tuple of (start, end) pairs with adjacent ranges merged.
+        """
+        if self.data_ranges is not None:
+            return self.data_ranges
+
+        ranges = []
+
+        def add_range(start, end):
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+
+        for field in self.fields:
+            dna_name = field.dna_name
+            if dna_name.is_pointer or dna_name.is_method_pointer:
+                continue
+            dna_type = field.dna_type
+            if not dna_type.fields:
+                add_range(field.dna_offset, field.dna_offset + field.dna_size)
+                continue
+            for index in range(dna_name.array_size):
+                offset = field.dna_offset + index * dna_type.size
+                for start, end in dna_type.get_data_ranges():
+                    add_range(offset + start, offset + end)
+
+        self.data_ranges = tuple(ranges)
+        return self.data_ranges
+
+    def get_pointer_offsets(self):
+        """
+        Return the offsets of all pointers in this struct, in ascending order.
+        Every item of a pointer array is included; method pointers are not.
+        """
+        if self.pointer_offsets is not None:
+            return self.pointer_offsets
+
+        offsets = []
+        for field in self.fields:
+            dna_name = field.dna_name
+            if dna_name.is_method_pointer:
+                continue
+            if dna_name.is_pointer:
+                pointer_size = field.dna_size // dna_name.array_size
+                offsets.extend(range(field.dna_offset, field.dna_offset + field.dna_size,
+                                     pointer_size))
+                continue
+            dna_type = field.dna_type
+            if not dna_type.fields:
+                continue
+            for index in range(dna_name.array_size):
+                offset = field.dna_offset + index * dna_type.size
+                offsets.extend(offset + sub_offset for sub_offset in dna_type.get_pointer_offsets())
+
+        self.pointer_offsets = tuple(offsets)
+        return self.pointer_offsets
+
+    def get_pointer_codec(self, header):
+        """
+        Return a struct.Struct that unpacks all pointers of one instance of
+        this struct (skipping everything else), or None if it has no pointers.
+        """
+        if self.pointer_codec is not None:
+            return self.pointer_codec
+        offsets = self.get_pointer_offsets()
+        if not offsets:
+            return None
+
+        pointer_format = 'I' if header.pointer_size == 4 else 'Q'
+        formats = [header.endian_str.decode('ascii')]
+        position = 0
+        for offset in offsets:
+            if offset > position:
+                formats.append('%dx' % (offset - position))
+            formats.append(pointer_format)
+            position = offset + header.pointer_size
+        if self.size > position:
+            formats.append('%dx' % (self.size - position))
+
+        self.pointer_codec = struct.Struct(''.join(formats))
+        return self.pointer_codec
+
+    def field_offset_from_path(self, header, path):
         """
         Support lookups as bytes or a tuple of bytes and optional index.
 
         C style 'id.name'   -->  (b'id', b'name')
         C style 'array[4]'  -->  ('array', 4)
+
+        Return (field, offset), where offset is relative to the start of
+        this struct. The field is None when the path cannot be found.
+        Results are cached per struct, as the same paths are typically
+        looked up for many blocks.
         """
+        try:
+            return self.path_cache[path]
+        except KeyError:
+            pass
+
+        result = self.path_cache[path] = self.resolve_path(header, path)
+        return result
+
+    def resolve_path(self, header, path):
+        """Uncached implementation of field_offset_from_path()."""
         if type(path) is tuple:
             name = path[0]
             if len(path) >= 2 and type(path[1]) is not bytes:
@@ -721,90 +1511,282 @@ class DNAStruct:
         assert(type(name) is bytes)
 
         field = self.field_from_name.get(name)
+        if field is None:
+            return None, 0
+
+        offset = field.dna_offset
+        if index != 0:
+            if field.dna_name.is_pointer:
+                index_offset = header.pointer_size * index
+            else:
+                index_offset = field.dna_type.size * index
+            assert(index_offset < field.dna_size)
+            offset += index_offset
+        if not name_tail:  # None or ()
+            return field, offset
+
+        field, tail_offset = field.dna_type.field_offset_from_path(header, name_tail)
+        return field, offset + tail_offset
 
+    def field_from_path(self, header, handle, path, offset=None):
+        """
+        Return the field for the path, and seek the handle to it.
+
+        The offset is the position of this struct in the file; when None, the
+        handle must be positioned at the start of this struct.
+        """
+        field, field_offset = self.field_offset_from_path(header, path)
         if field is not None:
-            handle.seek(field.dna_offset, os.SEEK_CUR)
-            if index != 0:
-                if field.dna_name.is_pointer:
-                    index_offset = header.pointer_size * index
-                else:
-                    index_offset = field.dna_type.size * index
-                assert(index_offset < field.dna_size)
-                handle.seek(index_offset, os.SEEK_CUR)
-            if not name_tail:  # None or ()
-                return field
+            if offset is None:
+                handle.seek(field_offset, os.SEEK_CUR)
             else:
-                return field.dna_type.field_from_path(header, handle, name_tail)
+                handle.seek(offset + field_offset, os.SEEK_SET)
+        return field
 
     def field_get(self, header, handle, path,
                   default=...,
                   use_nil=True, use_str=True,
+                  offset=None,
                   ):
-        field = self.field_from_path(header, handle, path)
+        field = self.field_from_path(header, handle, path, offset)
         if field is None:
-            if default is not ...:
-                return default
-            else:
-                raise KeyError("%r not found in %r (%r)" %
-                        (path, [f.dna_name.name_only for f in self.fields], self.dna_type_id))
+            return self.field_not_found(path, default)
 
-        dna_type = field.dna_type
+        if field.codec is None:
+            data = b''
+        else:
+            data = handle.read(field.codec.size)
+        return self.field_decode(header, field, path, data, 0,
+                                 use_nil=use_nil, use_str=use_str)
+
+    def field_get_from_data(self, header, data, offset, path,
+                            default=...,
+                            use_nil=True, use_str=True,
+                            ):
+        """
+        Like field_get(), but reads from a buffer (for example a memory-mapped
+        file) where this struct starts at the given offset.
+        """
+        field, field_offset = self.field_offset_from_path(header, path)
+        if field is None:
+            return self.field_not_found(path, default)
+
+        return self.field_decode(header, field, path, data, offset + field_offset,
+                                 use_nil=use_nil, use_str=use_str)
+
+    def field_not_found(self, path, default):
+        if default is not ...:
+            return default
+        raise KeyError("%r not found in %r (%r)" %
+                (path, [f.dna_name.name_only for f in self.fields], self.dna_type_id))
+
+    @staticmethod
+    def field_decode(header, field, path, data, offset,
+                     use_nil=True, use_str=True,
+                     ):
+        """
+        Decode the value of the field, stored in data at the given offset.
+        """
         dna_name = field.dna_name
+        if field.codec is None:
+            raise NotImplementedError("%r exists but isn't pointer, can't resolve field %r" %
+                    (path, dna_name.name_only), dna_name, field.dna_type)
 
-        if dna_name.is_pointer:
-            return DNA_IO.read_pointer(handle, header)
-        elif dna_type.dna_type_id == b'int':
-            if dna_name.array_size > 1:
-                return [DNA_IO.read_int(handle, header) for i in range(dna_name.array_size)]
-            return DNA_IO.read_int(handle, header)
-        elif dna_type.dna_type_id == b'short':
-            if dna_name.array_size > 1:
-                return [DNA_IO.read_short(handle, header) for i in range(dna_name.array_size)]
-            return DNA_IO.read_short(handle, header)
-        elif dna_type.dna_type_id == b'uint64_t':
-            if dna_name.array_size > 1:
-                return [DNA_IO.read_ulong(handle, header) for i in range(dna_name.array_size)]
-            return DNA_IO.read_ulong(handle, header)
-        elif dna_type.dna_type_id == b'float':
-            if dna_name.array_size > 1:
-                return [DNA_IO.read_float(handle, header) for i in range(dna_name.array_size)]
-            return DNA_IO.read_float(handle, header)
-        elif dna_type.dna_type_id == b'char':
+        values = field.codec.unpack_from(data, offset)
+        if len(values) > 1:
+            return list(values)
+
+        value = values[0]
+        if type(value) is bytes:
+            if use_nil:
+                value = DNA_IO.read_data0(value)
             if use_str:
-                if use_nil:
-                    return DNA_IO.read_string0(handle, dna_name.array_size)
-                else:
-                    return DNA_IO.read_string(handle, dna_name.array_size)
-            else:
-                if use_nil:
-                    return DNA_IO.read_bytes0(handle, dna_name.array_size)
-                else:
-                    return DNA_IO.read_bytes(handle, dna_name.array_size)
-        else:
-            raise NotImplementedError("%r exists but isn't pointer, can't resolve field %r" %
-                    (path, dna_name.name_only), dna_name, dna_type)
+                return value.decode('utf-8')
+        return value
+
+    def field_set(self, header, handle, path, value, offset=None):
+        assert(type(path) == bytes)
 
-    def field_set(self, header, handle, path, value):
+        field = self.field_from_path(header, handle, path, offset)
+        if field is None:
+            raise KeyError("%r not found in %r" %
+                    (path, [f.dna_name.name_only for f in self.fields]))
+
+        handle.write(self.field_encode(header, field, value))
+
+    def field_set_in_data(self, header, data, offset, path, value):
+        """
+        Like field_set(), but writes to a buffer in which this struct starts
+        at the given offset.
+        """
         assert(type(path) == bytes)
 
-        field = self.field_from_path(header, handle, path)
+        field, field_offset = self.field_offset_from_path(header, path)
         if field is None:
             raise KeyError("%r not found in %r" %
                     (path, [f.dna_name.name_only for f in self.fields]))
 
+        encoded = self.field_encode(header, field, value)
+        offset += field_offset
+        data[offset:offset + len(encoded)] = encoded
+
+    @staticmethod
+    def field_encode(header, field, value):
+        """
+        Return the bytes to write for setting the field to the value.
+        """
         dna_type = field.dna_type
         dna_name = field.dna_name
 
-        if dna_type.dna_type_id == b'char':
+        if dna_name.is_pointer:
+            # Checked first, as 'char *' and 'int *' must be written as pointers.
+            # Like reading, this only sets the first pointer of pointer arrays.
+            return field.codec.pack(value)
+        elif dna_type.dna_type_id == b'char':
             if type(value) is str:
-                return DNA_IO.write_string(handle, value, dna_name.array_size)
+                return DNA_IO.encode_string(value, dna_name.array_size)
             else:
-                return DNA_IO.write_bytes(handle, value, dna_name.array_size)
-        elif dna_type.dna_type_id == b'int':
-            DNA_IO.write_int(handle, header, value)
-        else:
+                return DNA_IO.encode_bytes(value, dna_name.array_size)
+        elif dna_type.dna_type_id == b'int' and dna_name.array_size == 1:
+            return DNA_IO.encode_int(header, value)
+        elif field.codec is None:
             raise NotImplementedError("Setting %r is not yet supported for %r" %
                                       (dna_type, dna_name), dna_name, dna_type)
+        elif dna_name.array_size == 1:
+            return field.codec.pack(value)
+        else:
+            return field.codec.pack(*value)
+
+
+class DNARecord(tuple):
+    """
+    Base class for the records returned by DNARecordDecoder.
+
+    Records are named tuples, so fields can be accessed by attribute or by
+    index; like BlendFileBlock, they can also be indexed with the field name
+    as bytes.
+    """
+    __slots__ = ()
+
+    # {b'field_name': index}, set on the generated subclasses.
+    index_from_name = {}
+
+    def __getitem__(self, key):
+        if type(key) is bytes:
+            key = self.index_from_name[key]
+        return tuple.__getitem__(self, key)
+
+
+class DNARecordDecoder:
+    """
+    Decodes an entire struct instance with a single unpack_from() call,
+    using one struct.Struct for all (also nested) fields.
+    """
+    __slots__ = (
+        # struct.Struct for the entire struct
+        "codec",
+        # str, format of the fields without the byte order character
+        "fields_format",
+        # int, number of values unpacked by 'fields_format'
+        "value_count",
+        # DNARecord subclass
+        "record_type",
+        # [(start, end or None, conversion function or None), ...] per field,
+        # where the field's value is values[start:end], or values[start] if end is None.
+        "steps",
+        # bool, whether any of the values needs conversion
+        "needs_conversion",
+        )
+
+    # Struct format characters, checked against the type size in the DNA.
+    FORMAT_FROM_TYPE = {
+        b'char': 's',
+        b'uchar': 'B',
+        b'int8_t': 'b',
+        b'short': 'h',
+        b'ushort': 'H',
+        b'int': 'i',
+        b'uint': 'I',
+        b'float': 'f',
+        b'double': 'd',
+        b'int64_t': 'q',
+        b'uint64_t': 'Q',
+        }
+
+    def __init__(self, header, dna_struct):
+        pointer_format = 'I' if header.pointer_size == 4 else 'Q'
+
+        formats = []
+        self.steps = []
+        self.value_count = 0
+        for field in dna_struct.fields:
+            dna_name = field.dna_name
+            dna_type = field.dna_type
+            array_size = dna_name.array_size
+            start = self.value_count
+
+            if dna_name.is_pointer or dna_name.is_method_pointer:
+                fmt, count, convert = pointer_format, array_size, None
+            elif dna_type.fields:
+                # Nested structs are flattened into this struct's format.
+                sub_decoder = dna_type.get_decoder(header)
+                formats.append(sub_decoder.fields_format * array_size)
+                self.value_count += sub_decoder.value_count * array_size
+                if array_size == 1:
+                    convert = sub_decoder.record_from_values
+                else:
+                    convert = functools.partial(sub_decoder.records_from_values, array_size)
+                self.steps.append((start, self.value_count, convert))
+                continue
+            else:
+                fmt = self.FORMAT_FROM_TYPE.get(dna_type.dna_type_id)
+                if fmt == 's':
+                    fmt, count, convert = '%ds' % field.dna_size, 1, DNA_IO.read_data0
+                elif fmt is None or struct.calcsize(fmt) != dna_type.size:
+                    # Unknown types are returned as raw bytes.
+                    fmt, count, convert = '%ds' % field.dna_size, 1, None
+                else:
+                    count, convert = array_size, None
+
+            if count > 1:
+                formats.append('%d%s' % (count, fmt))
+                self.steps.append((start, start + count, convert or list))
+            else:
+                formats.append(fmt)
+                self.steps.append((start, None, convert))
+            self.value_count += count
+
+        self.needs_conversion = any(end is not None or convert is not None
+                                    for _, end, convert in self.steps)
+        self.fields_format = ''.join(formats)
+        self.codec = struct.Struct(header.endian_str.decode('ascii') + self.fields_format)
+
+        field_names = [field.dna_name.name_only.decode('ascii') for field in dna_struct.fields]
+        base = collections.namedtuple(dna_struct.dna_type_id.decode('ascii'), field_names,
+                                      rename=True)
+        self.record_type = type(base.__name__, (DNARecord, base), {
+            '__slots__': (),
+            'index_from_name': {field.dna_name.name_only: index
+                                for index, field in enumerate(dna_struct.fields)},
+        })
+
+    def decode(self, data, offset):
+        return self.record_from_values(self.codec.unpack_from(data, offset))
+
+    def record_from_values(self, values):
+        if not self.needs_conversion:
+            return self.record_type._make(values)
+
+        decoded = []
+        for start, end, convert in self.steps:
+            value = values[start] if end is None else values[start:end]
+            decoded.append(value if convert is None else convert(value))
+        return self.record_type._make(decoded)
+
+    def records_from_values(self, array_size, values):
+        count = self.value_count
+        return [self.record_from_values(values[index * count:(index + 1) * count])
+                for index in range(array_size)]
 
 
 class DNA_IO:
@@ -819,24 +1801,57 @@ class DNA_IO:
     def __new__(cls, *args, **kwargs):
         raise RuntimeError("%s should not be instantiated" % cls)
 
+    # Struct format characters of the types that can be read.
+    FORMAT_FROM_TYPE = {
+        b'char': 's',
+        b'short': 'h',
+        b'int': 'i',
+        b'float': 'f',
+        b'uint64_t': 'Q',
+    }
+
     @staticmethod
-    def write_string(handle, astring, fieldlen):
+    def create_codec(header, dna_type, dna_name):
+        """
+        Returns a struct.Struct that reads the entire field in one go,
+        or None when fields of this type can't be read.
+        Pointer fields are read as a single pointer, even when they are arrays.
+        """
+        if dna_name.is_pointer:
+            fmt = 'I' if header.pointer_size == 4 else 'Q'
+        else:
+            fmt = DNA_IO.FORMAT_FROM_TYPE.get(dna_type.dna_type_id)
+            if fmt is None:
+                return None
+            if dna_name.array_size > 1:
+                fmt = '%d%s' % (dna_name.array_size, fmt)
+        return struct.Struct(header.endian_str.decode('ascii') + fmt)
+
+    @staticmethod
+    def encode_string(astring, fieldlen):
         assert(isinstance(astring, str))
         if len(astring) >= fieldlen:
             stringw = astring[0:fieldlen]
         else:
             stringw = astring + '\0'
-        handle.write(stringw.encode('utf-8'))
+        return stringw.encode('utf-8')
 
     @staticmethod
-    def write_bytes(handle, astring, fieldlen):
+    def write_string(handle, astring, fieldlen):
+        handle.write(DNA_IO.encode_string(astring, fieldlen))
+
+    @staticmethod
+    def encode_bytes(astring, fieldlen):
         assert(isinstance(astring, (bytes, bytearray)))
         if len(astring) >= fieldlen:
             stringw = astring[0:fieldlen]
         else:
             stringw = astring + b'\0'
+        return stringw
 
-        handle.write(stringw)
+    @staticmethod
+    def write_bytes(handle, astring, fieldlen):
+        handle.write(DNA_IO.encode_bytes(astring, fieldlen))
 
     @staticmethod
     def read_bytes(handle, length):
@@ -895,11 +1910,14 @@ class DNA_IO:
         return st.unpack(handle.read(st.size))[0]
 
     @staticmethod
-    def write_int(handle, fileheader, value):
+    def encode_int(fileheader, value):
         assert isinstance(value, int), 'value must be int, but is %r: %r' % (type(value), value)
         st = DNA_IO.SINT[fileheader.endian_index]
-        to_write = st.pack(value)
-        handle.write(to_write)
+        return st.pack(value)
+
+    @staticmethod
+    def write_int(handle, fileheader, value):
+        handle.write(DNA_IO.encode_int(fileheader, value))
 
     FLOAT = struct.Struct(b'<f'), struct.Struct(b'>f')
 
@@ -27,6 +27,8 @@ Requires the 3rd party packages CacheControl and lockfile.
 import os
 import logging
 import requests
+import requests.adapters
+import requests.packages.urllib3.util.retry
 import cachecontrol
 from cachecontrol.caches import FileCache
 
@@ -35,6 +37,19 @@ from . import appdirs
 log = logging.getLogger(__name__)
 _session = None  # requests.Session object that's set up for caching by requests_session().
 
+# Retry policy and connection pooling of all Requests sessions; see http_adapter().
+HTTP_MAX_RETRIES = 10
+# Read errors (including read timeouts) are retried only this often, so that a stalled
+# server is reported to the adaptive limiter instead of being retried for minutes.
+HTTP_MAX_READ_RETRIES = 1
+HTTP_RETRY_BACKOFF_FACTOR = 0.05
+HTTP_POOL_HOSTS = 10  # Number of hosts to keep connections to.
+# Default (connect, read) timeout of requests that don't pass their own; without it
+# Requests waits forever on a server that stopped responding. Requests with a body,
+# such as uploads, don't get a default timeout, as the server may take a while to
+# process them before responding.
+HTTP_TIMEOUT_SECS = (30, 60)
+
 
 def cache_directory(*subdirs) -> str:
     """Returns an OS-specifc cache location, and ensures it exists.
@@ -68,6 +83,70 @@ def cache_directory(*subdirs) -> str:
     return cache_dir
 
 
+def shared_cache_directory(*subdirs) -> str:
+    """Returns an OS-specific cache location for data that doesn't depend on the user.
+
+    Unlike cache_directory() this doesn't need the Blender ID add-on, and it
+    doesn't create the directory.
+
+    >>> shared_cache_directory('sub1')
+    '.../blender_cloud/shared/sub1'
+    """
+
+    user_cache_dir = appdirs.user_cache_dir(appname='Blender', appauthor=False)
+    return os.path.join(user_cache_dir, 'blender_cloud', 'shared', *subdirs)
+
+
+def http_adapter(pool_maxsize: int, *,
+                 adapter_class=requests.adapters.HTTPAdapter,
+                 use_http2=False,
+                 **kwargs) -> requests.adapters.HTTPAdapter:
+    """Creates an HTTP adapter with the shared retry policy and default timeout.
+
+    :param pool_maxsize: number of connections to keep alive per host. This should be
+        at least the number of threads that use the adapter simultaneously; surplus
+        connections are closed after use, and have to be set up again next time.
+    :param adapter_class: HTTPAdapter subclass to instantiate, with kwargs as extra
+        keyword arguments.
+    :param use_http2: use the HTTP/2 variant of the adapter class; only possible
+        when http2.is_available().
+    """
+
+    if use_http2:
+        from . import http2
+        adapter_class = http2.adapter_class(adapter_class)
+
+    retries = requests.packages.urllib3.util.retry.Retry(
+        total=HTTP_MAX_RETRIES,
+        read=HTTP_MAX_READ_RETRIES,
+        backoff_factor=HTTP_RETRY_BACKOFF_FACTOR,
+    )
+    adapter = adapter_class(max_retries=retries,
+                            pool_connections=HTTP_POOL_HOSTS,
+                            pool_maxsize=pool_maxsize,
+                            **kwargs)
+
+    # Requests has no session-wide timeout, so it's set on the adapter instead.
+    send = adapter.send
+
+    def send_with_timeout(request, timeout=None, **send_kwargs):
+        if timeout is None and request.body is None:
+            timeout = HTTP_TIMEOUT_SECS
+        return send(request, timeout=timeout, **send_kwargs)
+
+    adapter.send = send_with_timeout
+    return adapter
+
+
+def session_with_adapter(adapter: requests.adapters.HTTPAdapter) -> requests.Session:
+    """Creates a Requests session that uses the adapter for HTTP and HTTPS."""
+
+    session = requests.session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
 def requests_session() -> requests.Session:
     """Creates a Requests-Cache session object."""
 
@@ -76,10 +155,16 @@ def requests_session() -> requests.Session:
     if _session is not None:
         return _session
 
+    from . import pillar
+
     cache_name = cache_directory('blender_cloud_http')
     log.info('Storing cache in %s' % cache_name)
 
-    _session = cachecontrol.CacheControl(sess=requests.session(),
-                                         cache=FileCache(cache_name))
+    # Equivalent to cachecontrol.CacheControl(), but with our pooling and retry policy.
+    adapter = http_adapter(pillar.MAX_CONCURRENT_API_CALLS,
+                           adapter_class=cachecontrol.CacheControlAdapter,
+                           use_http2=pillar.use_http2(),
+                           cache=FileCache(cache_name))
+    _session = session_with_adapter(adapter)
 
     return _session
@@ -0,0 +1,189 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""Persistent index of downloaded files.
+
+Remembers which URL each file was downloaded from, with the HTTP validators
+(ETag and Last-Modified) for conditional requests, and when they were last
+validated against the server. This allows skipping the conditional GET request
+for files that were validated recently, also in later Blender sessions.
+
+Entries are keyed on the path of the downloaded file, as the URL of a file can
+change (for example when signed storage links expire) while its contents don't.
+A new download to the same path replaces the entry of the old URL.
+
+Older versions of this add-on stored the validators in a '.headers' JSON sidecar
+file per downloaded file. Those are imported (and removed) when the path is first
+looked up.
+
+The index is an SQLite database in the cache directory.
+"""
+
+import collections
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from . import cache
+
+log = logging.getLogger(__name__)
+
+# Files validated against the server less than this many seconds ago are
+# assumed to still be up to date, and aren't checked again.
+FRESHNESS_WINDOW_SECS = 12 * 3600
+
+DownloadEntry = collections.namedtuple(
+    'DownloadEntry', ['url', 'path', 'size', 'etag', 'last_modified', 'validated'])
+
+_connections = {}  # Mapping from database path to sqlite3.Connection.
+_lock = threading.Lock()  # The connections are shared between threads.
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS files (
+        path TEXT PRIMARY KEY,
+        url TEXT,
+        size INTEGER NOT NULL,
+        etag TEXT,
+        last_modified TEXT,
+        validated REAL NOT NULL
+    );
+'''
+
+
+def _connection() -> sqlite3.Connection:
+    """Returns the database connection for the current cache directory."""
+
+    # The cache directory depends on the logged-in user.
+    db_path = os.path.join(cache.cache_directory(), 'downloads.sqlite')
+    try:
+        return _connections[db_path]
+    except KeyError:
+        pass
+
+    log.debug('Opening download index %s', db_path)
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+    # The cache directory can be on a network filesystem, where WAL mode doesn't work,
+    # so the default rollback journal is used. Losing the last few records in a power
+    # failure is harmless, so don't sync to disk on every write.
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(_SCHEMA)
+    _connections[db_path] = conn
+    return conn
+
+
+def lookup(path: str, header_store: str = None) -> DownloadEntry:
+    """Returns the index entry for the path, or None if nothing was downloaded to it.
+
+    :param header_store: path of the sidecar file in which older versions of this
+        add-on stored the headers of the download. When the path is not in the
+        index, the sidecar file is imported as its entry, with URL None.
+    """
+
+    try:
+        with _lock:
+            row = _connection().execute(
+                'SELECT url, path, size, etag, last_modified, validated '
+                'FROM files WHERE path=?', (path,)).fetchone()
+    except sqlite3.Error as ex:
+        log.warning('Unable to read download index: %s', ex)
+        return None
+
+    if row is not None:
+        return DownloadEntry(*row)
+    if header_store is None:
+        return None
+    return _migrate_sidecar(path, header_store)
+
+
+def is_fresh(url: str, path: str) -> bool:
+    """Returns True when the path was downloaded and recently validated.
+
+    The file itself is checked to still exist with the indexed size. As entries
+    are keyed on the path, a different URL (such as a renewed signed storage link)
+    doesn't make the file stale; the URL is stored for the next download instead.
+    """
+
+    entry = lookup(path)
+    if entry is None:
+        return False
+    if time.time() - entry.validated > FRESHNESS_WINDOW_SECS:
+        return False
+    try:
+        if os.stat(path).st_size != entry.size:
+            return False
+    except FileNotFoundError:
+        return False
+
+    if entry.url != url:
+        try:
+            with _lock:
+                _connection().execute('UPDATE files SET url=? WHERE path=?', (url, path))
+        except sqlite3.Error as ex:
+            log.warning('Unable to update download index for %s: %s', path, ex)
+    return True
+
+
+def record(url: str, path: str, size: int, etag: str = None, last_modified: str = None,
+           validated: float = None):
+    """Records that the URL was downloaded to the path.
+
+    This replaces the entry of any URL that was downloaded to the path before.
+
+    :param validated: when the download was validated against the server, as
+        timestamp; defaults to now.
+    """
+
+    if validated is None:
+        validated = time.time()
+
+    try:
+        with _lock:
+            _connection().execute(
+                'INSERT OR REPLACE INTO files '
+                '(url, path, size, etag, last_modified, validated) VALUES (?, ?, ?, ?, ?, ?)',
+                (url, path, size, etag, last_modified, validated))
+    except sqlite3.Error as ex:
+        log.warning('Unable to update download index for %s: %s', path, ex)
+
+
+def _migrate_sidecar(path: str, header_store: str) -> DownloadEntry:
+    """Imports headers from a sidecar file, if it exists, and removes the file."""
+
+    try:
+        with open(header_store, 'r') as infile:
+            headers = json.load(infile)
+        size = int(headers.get('Content-Length') or -1)
+    except FileNotFoundError:
+        return None
+    except Exception as ex:
+        log.warning('Unable to load headers from %r, ignoring: %s', header_store, ex)
+        return None
+
+    log.debug('Importing headers from sidecar file %s', header_store)
+    # The URL isn't known, and the file was never validated as far as we know,
+    # so the next download does a conditional GET.
+    entry = DownloadEntry(None, path, size, headers.get('ETag'), headers.get('Last-Modified'), 0)
+    record(*entry)
+    try:
+        os.unlink(header_store)
+    except OSError as ex:
+        log.debug('Unable to remove %s: %s', header_store, ex)
+    return entry
@@ -0,0 +1,187 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""Optional HTTP/2 transport for Requests sessions, using httpx.
+
+With HTTP/2, many concurrent small requests (such as Pillar API calls) share a
+single multiplexed TLS connection, instead of each needing a connection of its own.
+
+This requires the 3rd party packages httpx and h2; when they aren't available,
+is_available() returns False and the regular Requests transport should be used.
+"""
+
+import io
+import logging
+import os.path
+import ssl
+import threading
+
+import cachecontrol
+import requests.adapters
+import requests.exceptions
+from requests.packages.urllib3.response import HTTPResponse
+
+try:
+    import httpx
+    # Only imported to check that it's installed; httpx needs it for HTTP/2 support.
+    import h2  # noqa: F401
+except ImportError:
+    httpx = None
+
+log = logging.getLogger(__name__)
+
+# Connection-specific headers are not allowed in HTTP/2; the body is decoded by httpx.
+SKIP_REQUEST_HEADERS = {'connection', 'host', 'keep-alive', 'proxy-connection',
+                        'transfer-encoding', 'upgrade'}
+SKIP_RESPONSE_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding'}
+
+
+def is_available() -> bool:
+    """Returns whether httpx with HTTP/2 support can be used."""
+
+    return httpx is not None
+
+
+class _ResponseBody(io.BytesIO):
+    """In-memory response body that closes itself when read to the end.
+
+    This is how the file of a regular response behaves, and CacheControl relies
+    on it to know when a response is complete and can be stored.
+    """
+
+    def __init__(self, content: bytes):
+        super().__init__(content)
+        self._length = len(content)
+
+    def read(self, size=-1):
+        if self.closed:
+            return b''
+        data = super().read(size)
+        if self.tell() >= self._length:
+            self.close()
+        return data
+
+
+class HTTP2Adapter(requests.adapters.HTTPAdapter):
+    """Transport adapter that sends requests with httpx, over HTTP/2 when the server supports it.
+
+    Requests via a proxy, or with a client certificate, are sent by the regular
+    HTTPAdapter. Responses are always read completely, so this adapter is meant for
+    API calls and not for downloading large files.
+    """
+
+    def __init__(self, *args, http1=True, **kwargs):
+        """Constructor, takes the same arguments as HTTPAdapter.
+
+        :param http1: whether to allow HTTP/1.1. When False, HTTP/2 is also used
+            for 'http://' URLs, without upgrading the connection.
+        """
+        if not is_available():
+            raise RuntimeError('HTTP/2 support requires httpx and h2')
+
+        super().__init__(*args, **kwargs)
+        self.http1 = http1
+        self._clients = {}  # Mapping from 'verify' argument to httpx.Client.
+        self._clients_lock = threading.Lock()
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        scheme = request.url.split(':', 1)[0].lower()
+        if cert or (proxies and (proxies.get(scheme) or proxies.get('all'))):
+            return super().send(request, stream=stream, timeout=timeout, verify=verify,
+                                cert=cert, proxies=proxies)
+
+        headers = [(name, value) for name, value in request.headers.items()
+                   if name.lower() not in SKIP_REQUEST_HEADERS]
+        try:
+            response = self._client(verify).request(request.method, request.url,
+                                                    headers=headers,
+                                                    content=request.body,
+                                                    timeout=self._timeout(timeout))
+        except httpx.TimeoutException as ex:
+            raise requests.exceptions.Timeout(ex, request=request)
+        except httpx.TransportError as ex:
+            raise requests.exceptions.ConnectionError(ex, request=request)
+
+        # Wrap the response so that Requests (and CacheControl) can handle it as usual.
+        content = response.content
+        response_headers = {name: value for name, value in response.headers.items()
+                            if name.lower() not in SKIP_RESPONSE_HEADERS}
+        response_headers['Content-Length'] = str(len(content))
+        raw = HTTPResponse(body=_ResponseBody(content),
+                           headers=response_headers,
+                           status=response.status_code,
+                           reason=response.reason_phrase,
+                           preload_content=False,
+                           decode_content=False)
+        return self.build_response(request, raw)
+
+    def close(self):
+        super().close()
+        with self._clients_lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+    def _client(self, verify) -> 'httpx.Client':
+        # Each client has its own connection pool, so concurrent requests must get the
+        # same client in order to share a connection.
+        with self._clients_lock:
+            try:
+                return self._clients[verify]
+            except KeyError:
+                pass
+            client = self._clients[verify] = self._create_client(verify)
+            return client
+
+    def _create_client(self, verify) -> 'httpx.Client':
+        if isinstance(verify, str):
+            # Requests passes the path of the CA bundle to use.
+            if os.path.isdir(verify):
+                verify = ssl.create_default_context(capath=verify)
+            else:
+                verify = ssl.create_default_context(cafile=verify)
+
+        limits = httpx.Limits(max_connections=self._pool_maxsize,
+                              max_keepalive_connections=self._pool_maxsize)
+        transport = httpx.HTTPTransport(verify=verify,
+                                        http1=self.http1,
+                                        http2=True,
+                                        limits=limits,
+                                        retries=self.max_retries.total or 0)
+        return httpx.Client(transport=transport)
+
+    @staticmethod
+    def _timeout(timeout) -> 'httpx.Timeout':
+        """Converts a Requests timeout to an httpx timeout."""
+
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            return httpx.Timeout(read, connect=connect)
+        return httpx.Timeout(timeout)
+
+
+class CachingHTTP2Adapter(cachecontrol.CacheControlAdapter, HTTP2Adapter):
+    """CacheControl adapter that sends its requests with HTTP2Adapter."""
+
+
+def adapter_class(base_class):
+    """Returns the HTTP/2 variant of a class returned by cache.http_adapter()."""
+
+    if issubclass(base_class, cachecontrol.CacheControlAdapter):
+        return CachingHTTP2Adapter
+    return HTTP2Adapter
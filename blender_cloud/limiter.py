@@ -0,0 +1,165 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""Adaptive concurrency limiting for requests to Pillar.
+
+The limit on the number of concurrent requests is adjusted with AIMD (additive
+increase, multiplicative decrease), like TCP congestion control: while requests
+succeed the limit slowly grows, and when the server signals it is overloaded
+(HTTP 429 or 503, a timeout or a refused connection) the limit is halved.
+
+Operations that have to wait for a slot are started in order of their Priority.
+"""
+
+import asyncio
+import contextlib
+import enum
+import heapq
+import itertools
+import logging
+import time
+
+import requests.exceptions
+
+log = logging.getLogger(__name__)
+
+# HTTP status codes with which a server indicates it's overloaded.
+OVERLOAD_STATUS_CODES = {429, 503}
+
+
+class Priority(enum.IntEnum):
+    """Priority classes of operations, from most to least urgent."""
+
+    # The user is waiting for this, e.g. after clicking a folder in the texture browser.
+    INTERACTIVE = 0
+    # Shown on screen as soon as it's done, such as thumbnails.
+    VISIBLE = 1
+    # Likely needed soon, but not shown yet.
+    PREFETCH = 2
+    # Nobody is waiting for this in particular, such as large file downloads.
+    BACKGROUND = 3
+
+
+def is_overload_error(ex: BaseException) -> bool:
+    """Returns whether the exception indicates that the server is overloaded."""
+
+    if isinstance(ex, (TimeoutError, asyncio.TimeoutError,
+                       requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return True
+    # Both Requests and the Pillar SDK attach the HTTP response to their exceptions.
+    response = getattr(ex, 'response', None)
+    return getattr(response, 'status_code', None) in OVERLOAD_STATUS_CODES
+
+
+class AdaptiveLimiter:
+    """Limits the number of concurrent operations, adapting the limit to the server.
+
+    Use as 'async with limiter.slot(priority): ...'. Waiting operations are started
+    in order of priority, and in the order in which they arrived within a priority.
+    """
+
+    def __init__(self, name: str, initial_limit: int, *,
+                 min_limit=1, max_limit=16, backoff_secs=1.0):
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        # The limit is decreased at most once per this many seconds, so that a burst of
+        # failures from the same overload doesn't drop the limit to the minimum at once.
+        self.backoff_secs = backoff_secs
+
+        self.in_flight = 0
+        # Heap of (priority, sequence number, future) tuples.
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._last_decrease = float('-inf')
+
+    def __repr__(self):
+        return '<%s %r limit=%.1f in_flight=%d waiting=%d>' % (
+            type(self).__name__, self.name, self.limit, self.in_flight, len(self._waiters))
+
+    async def acquire(self, priority=Priority.INTERACTIVE):
+        """Waits until an operation of the given priority may start."""
+
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+
+        future = asyncio.get_event_loop().create_future()
+        waiter = (priority, next(self._sequence), future)
+        heapq.heappush(self._waiters, waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # We were given a slot but got cancelled before using it.
+                self._release_slot()
+            else:
+                # A release() in the same loop iteration may already have popped us.
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+                else:
+                    heapq.heapify(self._waiters)
+            raise
+
+    def release(self, *, success: bool, overloaded=False):
+        """Marks the end of an operation, and adjusts the limit based on its outcome.
+
+        :param success: whether the operation succeeded.
+        :param overloaded: whether the operation failed because the server is overloaded.
+        """
+
+        if overloaded:
+            now = time.monotonic()
+            if now - self._last_decrease > self.backoff_secs:
+                self._last_decrease = now
+                self.limit = max(float(self.min_limit), self.limit / 2)
+                log.info('%s: server seems overloaded, limiting to %d concurrent requests',
+                         self.name, int(self.limit))
+        elif success and self.in_flight >= int(self.limit):
+            # Only grow when the limit is actually reached; otherwise it isn't tested.
+            # This adds 1 to the limit per 'limit' successful operations.
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+
+        self._release_slot()
+
+    def _release_slot(self):
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < int(self.limit):
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority=Priority.INTERACTIVE):
+        """Async context manager that runs its body when the limit allows."""
+
+        await self.acquire(priority)
+        success = overloaded = False
+        try:
+            yield
+            success = True
+        except Exception as ex:
+            overloaded = is_overload_error(ex)
+            raise
+        finally:
+            self.release(success=success, overloaded=overloaded)
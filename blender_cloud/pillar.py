@@ -23,18 +23,20 @@ import os
 import functools
 import logging
 from contextlib import closing, contextmanager
+import queue
+import threading
+import time
 import urllib.parse
 import pathlib
 
-import requests.adapters
-import requests.packages.urllib3.util.retry
 import requests.structures
 import pillarsdk
 import pillarsdk.exceptions
 import pillarsdk.utils
 from pillarsdk.utils import sanitize_filename
 
-from . import cache
+from . import async_http, cache, download_index, http2
+from .limiter import Priority
 
 SUBCLIENT_ID = 'PILLAR'
 TEXTURE_NODE_TYPES = {'texture', 'hdri'}
@@ -44,17 +46,66 @@ RFC1123_DATE_FORMAT = '%a, %d %b %Y %H:%M:%S GMT'
 _pillar_api = {}  # will become a mapping from bool (cached/non-cached) to pillarsdk.Api objects.
 log = logging.getLogger(__name__)
 
-_retries = requests.packages.urllib3.util.retry.Retry(
-    total=10,
-    backoff_factor=0.05,
-)
-_http_adapter = requests.adapters.HTTPAdapter(max_retries=_retries)
-uncached_session = requests.session()
-uncached_session.mount('https://', _http_adapter)
-uncached_session.mount('http://', _http_adapter)
+# Upper bounds of the number of simultaneous Pillar API calls and file downloads.
+# The actual limits adapt to the server's responses; see limiter.AdaptiveLimiter.
+MAX_CONCURRENT_API_CALLS = 8
+MAX_CONCURRENT_DOWNLOADS = 8
+
+# Send Pillar API calls over HTTP/2 when httpx and h2 are available, so that
+# concurrent calls share a single connection. File downloads always use HTTP/1.1.
+HTTP2_API_CALLS = True
+_uncached_api_session = None  # requests.Session for the non-caching Pillar API.
 
 _testing_blender_id_profile = None  # Just for testing, overrides what is returned by blender_id_profile.
-_downloaded_urls = set()  # URLs we've downloaded this Blender session.
+
+# The download chunk size grows while chunks arrive faster than this, up to the maximum size,
+# and shrinks again (down to the requested chunk size) when they arrive slower.
+DOWNLOAD_CHUNK_TARGET_SECS = 0.1
+DOWNLOAD_CHUNK_MAX_SIZE = 4 * 1024 * 1024
+DOWNLOAD_QUEUE_SIZE = 16  # Number of chunks waiting to be written to disk.
+
+# Files of at least this size are downloaded as multiple byte ranges in parallel,
+# if the server supports range requests.
+RANGED_DOWNLOAD_MIN_SIZE = 32 * 1024 * 1024
+RANGED_DOWNLOAD_PARTS = 4
+# How often the progress of a ranged download is saved, so that it can be resumed.
+DOWNLOAD_CHECKPOINT_INTERVAL_SECS = 2.0
+# Single-stream downloads smaller than this aren't checkpointed, as downloading them
+# again is cheaper than keeping their checkpoint on disk.
+DOWNLOAD_CHECKPOINT_MIN_SIZE = 1024 * 1024
+
+# Session for non-cached API calls and uploads.
+uncached_session = cache.session_with_adapter(cache.http_adapter(MAX_CONCURRENT_API_CALLS))
+# File links point to a storage/CDN host rather than to Pillar itself. Their downloads
+# get their own connection pool, with a connection for every part of every download.
+download_session = cache.session_with_adapter(
+    cache.http_adapter(MAX_CONCURRENT_DOWNLOADS * RANGED_DOWNLOAD_PARTS))
+# Download small files, such as thumbnails, with async_http instead of Requests, so
+# that they don't each occupy a thread. Requests is still used for files that are
+# known to be larger than ASYNC_HTTP_MAX_SIZE, and when a proxy is configured.
+ASYNC_HTTP_DOWNLOADS = True
+ASYNC_HTTP_MAX_SIZE = 512 * 1024
+
+# File documents requested within this many seconds of each other are fetched with a
+# single query, of at most FILE_BATCH_MAX_SIZE documents.
+FILE_BATCH_WINDOW_SECS = 0.05
+FILE_BATCH_MAX_SIZE = 50
+_pending_file_batches = {}  # Mapping from (priority, projection as JSON) to {file ID: asyncio.Future}.
+
+# Mapping from target filename to [asyncio.Lock, number of download_to_file() calls using it].
+# Concurrent downloads to the same file take turns, as they share the '.part' file.
+_download_locks = {}
+
+# Read-only class methods of Pillar SDK resources. Identical concurrent calls to these
+# share a single HTTP request; see pillar_call().
+COALESCED_METHODS = {'all', 'all_from_endpoint', 'find', 'find_first', 'find_from_endpoint',
+                     'find_one', 'me'}
+_in_flight_calls = {}  # Mapping from coalescing key to _SharedCall.
+
+# The user's credentials are checked with Pillar again when the previous check is older
+# than this; see check_pillar_credentials(). Set to 0 to check every time.
+CREDENTIALS_CACHE_TTL_SECS = 5 * 60
+_cached_credentials = None  # (subclient user ID, token, expiry time, db_user) of the last check.
 
 
 class UserNotLoggedInError(RuntimeError):
@@ -178,6 +229,26 @@ def pillar_user_uuid() -> str:
     return blender_id.get_subclient_user_id(SUBCLIENT_ID)
 
 
+def use_http2() -> bool:
+    """Returns whether Pillar API calls should be sent over HTTP/2."""
+
+    return HTTP2_API_CALLS and http2.is_available()
+
+
+def uncached_api_session() -> requests.Session:
+    """Returns the Requests session for non-cached Pillar API calls."""
+
+    global _uncached_api_session
+
+    if not use_http2():
+        return uncached_session
+
+    if _uncached_api_session is None:
+        adapter = cache.http_adapter(MAX_CONCURRENT_API_CALLS, use_http2=True)
+        _uncached_api_session = cache.session_with_adapter(adapter)
+    return _uncached_api_session
+
+
 def pillar_api(pillar_endpoint: str = None, caching=True) -> pillarsdk.Api:
     """Returns the Pillar SDK API object for the current user.
 
@@ -209,7 +280,7 @@ def pillar_api(pillar_endpoint: str = None, caching=True) -> pillarsdk.Api:
                                         username=subclient['subclient_user_id'],
                                         password=SUBCLIENT_ID,
                                         token=subclient['token'])
-        _noncaching_api.requests_session = uncached_session
+        _noncaching_api.requests_session = uncached_api_session()
 
         # Send the addon version as HTTP header.
         from blender_cloud import bl_info
@@ -225,38 +296,93 @@ def pillar_api(pillar_endpoint: str = None, caching=True) -> pillarsdk.Api:
     return _pillar_api[caching]
 
 
-# This is an asyncio.Semaphore object, which is late-instantiated to be sure
-# the asyncio loop has been created properly. On Windows we create a new one,
-# which can cause this semaphore to still be linked against the old default
-# loop.
-pillar_semaphore = None
+# These are limiter.AdaptiveLimiter objects, instantiated by async_loop when the
+# asyncio loop is set up. Pillar API calls and file downloads are limited
+# separately, so that a big download doesn't hold up browsing.
+pillar_limiter = None
+download_limiter = None
+
+
+class _SharedCall:
+    """A Pillar call that is awaited by one or more pillar_call() callers."""
 
+    __slots__ = ('task', 'waiters')
 
-async def pillar_call(pillar_func, *args, caching=True, **kwargs):
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+async def pillar_call(pillar_func, *args, caching=True, priority=Priority.INTERACTIVE, **kwargs):
     """Calls a Pillar function.
 
-    A semaphore is used to ensure that there won't be too many
-    calls to Pillar simultaneously.
+    A limiter is used to ensure that there won't be too many calls to Pillar
+    simultaneously. The limit adapts to how well the server keeps up.
+
+    Concurrent calls to the same read-only class method (see COALESCED_METHODS) with
+    the same arguments share a single call and its result, so the result should not
+    be modified. The shared call is performed at the priority of the first caller,
+    and is only cancelled when all its callers are.
+
+    :param priority: calls that have to wait are performed in order of priority.
     """
 
-    partial = functools.partial(pillar_func, *args, api=pillar_api(caching=caching), **kwargs)
-    loop = asyncio.get_event_loop()
+    key = _coalescing_key(pillar_func, args, kwargs, caching)
+    if key is None:
+        return await _limited_pillar_call(pillar_func, args, kwargs, caching, priority)
 
-    # Use explicit calls to acquire() and release() so that we have more control over
-    # how long we wait and how we handle timeouts.
-    try:
-        await asyncio.wait_for(pillar_semaphore.acquire(), timeout=10, loop=loop)
-    except asyncio.TimeoutError:
-        log.info('Waiting for semaphore to call %s', pillar_func.__name__)
-        try:
-            await asyncio.wait_for(pillar_semaphore.acquire(), timeout=50, loop=loop)
-        except asyncio.TimeoutError:
-            raise RuntimeError('Timeout waiting for Pillar Semaphore!')
+    shared = _in_flight_calls.get(key)
+    if shared is None:
+        task = asyncio.ensure_future(
+            _limited_pillar_call(pillar_func, args, kwargs, caching, priority))
+        shared = _in_flight_calls[key] = _SharedCall(task)
+        task.add_done_callback(functools.partial(_forget_shared_call, key, shared))
+    else:
+        log.debug('Sharing in-flight call to %s', pillar_func.__qualname__)
 
+    shared.waiters += 1
     try:
-        return await loop.run_in_executor(None, partial)
+        # Shielded, so that a cancelled caller doesn't cancel the call for others.
+        return await asyncio.shield(shared.task)
     finally:
-        pillar_semaphore.release()
+        shared.waiters -= 1
+        if not shared.waiters and not shared.task.done():
+            # All callers were cancelled.
+            _forget_shared_call(key, shared)
+            shared.task.cancel()
+
+
+def _coalescing_key(pillar_func, args: tuple, kwargs: dict, caching: bool):
+    """Returns the key under which identical calls are shared, or None if they can't be."""
+
+    owner = getattr(pillar_func, '__self__', None)
+    if not isinstance(owner, type) or pillar_func.__name__ not in COALESCED_METHODS:
+        return None
+    try:
+        normalized_args = json.dumps([args, kwargs], sort_keys=True)
+    except TypeError:
+        # Not plain JSON data, so we can't tell whether calls are identical.
+        return None
+    return owner, pillar_func.__name__, caching, normalized_args
+
+
+def _forget_shared_call(key, shared: _SharedCall, *args):
+    if _in_flight_calls.get(key) is shared:
+        del _in_flight_calls[key]
+
+
+async def _limited_pillar_call(pillar_func, args: tuple, kwargs: dict, caching: bool,
+                               priority: Priority):
+    partial = functools.partial(pillar_func, *args, api=pillar_api(caching=caching), **kwargs)
+    loop = asyncio.get_event_loop()
+
+    async with pillar_limiter.slot(priority):
+        try:
+            return await loop.run_in_executor(None, partial)
+        except (pillarsdk.UnauthorizedAccess, pillarsdk.ForbiddenAccess):
+            # The credentials may have been revoked, so check them again next time.
+            invalidate_credentials_cache()
+            raise
 
 
 def sync_call(pillar_func, *args, caching=True, **kwargs):
@@ -273,8 +399,13 @@ async def check_pillar_credentials(required_roles: set):
     :raises CredentialsNotSyncedError: when the user is logged in on Blender ID but
         doesn't have a valid subclient token for Pillar.
     :returns: the Pillar User ID of the current user.
+
+    The user is only fetched from Pillar when it wasn't in the last
+    CREDENTIALS_CACHE_TTL_SECS; the roles are checked every time.
     """
 
+    global _cached_credentials
+
     profile = blender_id_profile()
     if not profile:
         raise UserNotLoggedInError()
@@ -287,16 +418,25 @@ async def check_pillar_credentials(required_roles: set):
     if not pillar_user_id:
         raise CredentialsNotSyncedError()
 
-    try:
-        db_user = await pillar_call(pillarsdk.User.me)
-    except (pillarsdk.UnauthorizedAccess, pillarsdk.ResourceNotFound, pillarsdk.ForbiddenAccess):
-        raise CredentialsNotSyncedError()
+    token = subclient['token']
+    cached = _cached_credentials
+    if cached and cached[:2] == (pillar_user_id, token) and time.monotonic() < cached[2]:
+        db_user = cached[3]
+    else:
+        try:
+            db_user = await pillar_call(pillarsdk.User.me)
+        except (pillarsdk.UnauthorizedAccess, pillarsdk.ResourceNotFound,
+                pillarsdk.ForbiddenAccess):
+            raise CredentialsNotSyncedError()
+        expires = time.monotonic() + CREDENTIALS_CACHE_TTL_SECS
+        _cached_credentials = (pillar_user_id, token, expires, db_user)
 
     roles = set(db_user.roles or set())
     log.getChild('check_pillar_credentials').debug('user has roles %r', roles)
     if required_roles and not required_roles.intersection(roles):
         # Delete the subclient info. This forces a re-check later, which can
         # then pick up on the user's new status.
+        invalidate_credentials_cache()
         del profile.subclients[SUBCLIENT_ID]
         profile.save_json()
 
@@ -305,6 +445,13 @@ async def check_pillar_credentials(required_roles: set):
     return db_user
 
 
+def invalidate_credentials_cache():
+    """Forces the next check_pillar_credentials() call to check with Pillar."""
+
+    global _cached_credentials
+    _cached_credentials = None
+
+
 async def refresh_pillar_credentials(required_roles: set):
     """Refreshes the authentication token on Pillar.
 
@@ -329,6 +476,7 @@ async def refresh_pillar_credentials(required_roles: set):
 
     # Test the new URL
     _pillar_api = None
+    invalidate_credentials_cache()
     return await check_pillar_credentials(required_roles)
 
 
@@ -415,120 +563,653 @@ async def get_texture_projects(max_results=None) -> list:
     return children['_items']
 
 
-async def download_to_file(url, filename, *,
-                           header_store: str,
-                           chunk_size=100 * 1024,
-                           future: asyncio.Future = None):
-    """Downloads a file via HTTP(S) directly to the filesystem."""
+async def find_file_doc(file_id: str, projection: dict,
+                        priority=Priority.VISIBLE) -> pillarsdk.File:
+    """Finds a File document, batching lookups with other coroutines.
 
-    stored_headers = {}
-    if os.path.exists(filename) and os.path.exists(header_store):
-        log.debug('Loading cached headers %r', header_store)
+    Lookups with the same projection and priority that are requested within
+    FILE_BATCH_WINDOW_SECS are resolved with a single File.all() query.
+
+    :returns: the File, or None if it does not exist.
+    """
+
+    loop = asyncio.get_event_loop()
+    batch_key = (priority, json.dumps(projection, sort_keys=True))
+
+    batch = _pending_file_batches.get(batch_key)
+    if batch is None:
+        batch = _pending_file_batches[batch_key] = {}
+        loop.call_later(FILE_BATCH_WINDOW_SECS, _start_file_batch,
+                        batch_key, batch, projection, priority)
+
+    future = batch.get(file_id)
+    if future is None:
+        future = batch[file_id] = loop.create_future()
+        if len(batch) >= FILE_BATCH_MAX_SIZE:
+            _start_file_batch(batch_key, batch, projection, priority)
+
+    # Shielded, so that a cancelled caller doesn't cancel the lookup for others.
+    return await asyncio.shield(future)
+
+
+def _start_file_batch(batch_key: tuple, batch: dict, projection: dict, priority: Priority):
+    if _pending_file_batches.get(batch_key) is not batch:
+        # Already started because it was full.
+        return
+    del _pending_file_batches[batch_key]
+    asyncio.ensure_future(_fetch_file_batch(batch, projection, priority))
+
+
+async def _fetch_file_batch(batch: dict, projection: dict, priority: Priority):
+    """Fetches the File documents of the batch, and passes them to the waiting futures."""
+
+    file_ids = list(batch.keys())
+    log.debug('Fetching %d File documents in one query', len(file_ids))
+    try:
+        result = await pillar_call(pillarsdk.File.all, {
+            'where': {'_id': {'$in': file_ids}},
+            'projection': projection,
+            'max_results': len(file_ids),
+        }, priority=priority)
+    except asyncio.CancelledError:
+        # Listed separately, as it is an Exception subclass on Python 3.7.
+        _cancel_file_batch(batch)
+        raise
+    except Exception as ex:
+        for future in batch.values():
+            if not future.done():
+                future.set_exception(ex)
+        return
+    except BaseException:
+        _cancel_file_batch(batch)
+        raise
+
+    file_docs = {file_doc['_id']: file_doc for file_doc in result['_items']}
+    for file_id, future in batch.items():
+        if not future.done():
+            future.set_result(file_docs.get(file_id))
+
+
+def _cancel_file_batch(batch: dict):
+    """Cancels the futures of the batch, so that their waiters don't hang forever."""
+
+    for future in batch.values():
+        future.cancel()
+
+
+def _iter_adaptive_chunks(response, min_chunk_size: int):
+    """Yields the body of a streamed response in chunks that adapt to the throughput.
+
+    Chunks start at min_chunk_size bytes, and double in size as long as they are
+    read faster than DOWNLOAD_CHUNK_TARGET_SECS.
+    """
+    raw = response.raw
+    chunk_size = min_chunk_size
+    while True:
+        start = time.monotonic()
+        block = raw.read(chunk_size, decode_content=True)
+        duration = time.monotonic() - start
+        if not block:
+            # Decoded data can still be buffered after the connection closed,
+            # so only stop when nothing was read from a closed response.
+            if raw.closed:
+                break
+            continue
+        yield block
+
+        if len(block) < chunk_size:
+            # Chunk size wasn't the limiting factor.
+            continue
+        if duration < DOWNLOAD_CHUNK_TARGET_SECS / 2:
+            chunk_size = min(chunk_size * 2, DOWNLOAD_CHUNK_MAX_SIZE)
+        elif duration > DOWNLOAD_CHUNK_TARGET_SECS * 2:
+            chunk_size = max(chunk_size // 2, min_chunk_size)
+
+
+def _write_pipelined(chunks, outfile, future: asyncio.Future = None):
+    """Writes the chunks to the file on a separate writer thread.
+
+    This keeps the network reads going while the disk is busy. The chunks are
+    passed through a bounded queue, so a slow disk still throttles the download.
+    """
+    chunk_queue = queue.Queue(maxsize=DOWNLOAD_QUEUE_SIZE)
+    errors = []
+
+    def writer():
         try:
-            with open(header_store, 'r') as infile:
-                stored_headers = requests.structures.CaseInsensitiveDict(json.load(infile))
-
-            # Check file length.
-            expected_content_length = int(stored_headers['Content-Length'])
-            statinfo = os.stat(filename)
-            if expected_content_length == statinfo.st_size:
-                # File exists, and is of the correct length. Don't bother downloading again
-                # if we already downloaded it this session.
-                if url in _downloaded_urls:
-                    log.debug('Already downloaded %s this session, skipping this request.',
-                              url)
-                    return
-            else:
-                log.debug('File size should be %i but is %i; ignoring cache.',
-                          expected_content_length, statinfo.st_size)
-                stored_headers = {}
+            block = chunk_queue.get()
+            while block is not None:
+                outfile.write(block)
+                block = chunk_queue.get()
         except Exception as ex:
-            log.warning('Unable to load headers from %r, ignoring cache: %s', header_store, str(ex))
+            errors.append(ex)
+            # Keep consuming, so that the reader doesn't block on a full queue.
+            while chunk_queue.get() is not None:
+                pass
+
+    writer_thread = threading.Thread(target=writer, name='download-writer', daemon=True)
+    writer_thread.start()
+    try:
+        for block in chunks:
+            if is_cancelled(future):
+                raise asyncio.CancelledError('Downloading was cancelled')
+            if errors:
+                break
+            chunk_queue.put(block)
+    finally:
+        chunk_queue.put(None)
+        writer_thread.join()
+
+    if errors:
+        raise errors[0]
+
+
+async def _download_async(response: async_http.Response, part_path: str, open_mode: str,
+                          chunk_size: int, future: asyncio.Future = None):
+    """Downloads the body of an async_http response to the file.
+
+    The body is read on the event loop, and written to disk on a thread, so that
+    a slow disk doesn't stall the loop. It is buffered in memory up to
+    ASYNC_HTTP_MAX_SIZE bytes, so that small files are written in one go.
+    """
 
     loop = asyncio.get_event_loop()
+    buffer = bytearray()
+    with closing(response):
+        while True:
+            if is_cancelled(future):
+                raise asyncio.CancelledError('Downloading was cancelled')
+            block = await response.read(chunk_size)
+            buffer += block
+            if block and len(buffer) < ASYNC_HTTP_MAX_SIZE:
+                continue
+
+            data, buffer = buffer, bytearray()
+            await loop.run_in_executor(None, _write_file, part_path, open_mode, data)
+            open_mode = 'ab'
+            if not block:
+                break
+
+
+def _write_file(filename: str, open_mode: str, data: bytes):
+    with with_existing_dir(filename, open_mode) as outfile:
+        outfile.write(data)
+
+
+def _pwrite(fd: int, data: bytes, offset: int):
+    """Writes all data to the file descriptor at the given offset."""
+    view = memoryview(data)
+    if hasattr(os, 'pwrite'):
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+        return
+
+    # Windows has no pwrite(). This is only safe because every
+    # thread uses its own file descriptor.
+    os.lseek(fd, offset, os.SEEK_SET)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _download_ranges(response, file_size: int) -> list:
+    """Returns the byte ranges to download in parallel, or None to use a single stream.
+
+    :param response: the response to the initial GET request.
+    :param file_size: the expected size of the file, or None if unknown.
+    :returns: list of (start, end) tuples, where 'end' is exclusive.
+    """
+    if not file_size or file_size < RANGED_DOWNLOAD_MIN_SIZE:
+        return None
+
+    headers = response.headers
+    if headers.get('Accept-Ranges', '').lower() != 'bytes':
+        log.debug('Server does not support range requests, downloading as single stream.')
+        return None
+    if headers.get('Content-Encoding', 'identity') != 'identity':
+        return None
+    if int(headers.get('Content-Length') or -1) != file_size:
+        log.debug('File size is %r but Content-Length is %r, downloading as single stream.',
+                  file_size, headers.get('Content-Length'))
+        return None
+
+    part_size = -(-file_size // RANGED_DOWNLOAD_PARTS)  # rounded up
+    return [(start, min(start + part_size, file_size))
+            for start in range(0, file_size, part_size)]
+
+
+def _checkpoint_validator(checkpoint: dict) -> str:
+    """Returns the value for the If-Range header when resuming, or None if we can't resume.
+
+    Weak ETags can't be used for range requests, so those fall back to Last-Modified.
+    """
+    etag = checkpoint.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return checkpoint.get('Last-Modified') or None
+
+
+def _load_checkpoint(checkpoint_path: str) -> dict:
+    """Loads the checkpoint of a partial download, returns None if there is no usable one."""
+    try:
+        with open(checkpoint_path, 'r') as infile:
+            checkpoint = json.load(infile)
+    except FileNotFoundError:
+        return None
+    except Exception as ex:
+        log.warning('Unable to load download checkpoint %r, starting over: %s',
+                    checkpoint_path, ex)
+        return None
+
+    if not checkpoint.get('Content-Length') or not _checkpoint_validator(checkpoint):
+        return None
+    return checkpoint
+
+
+def _part_matches_checkpoint(part_path: str, checkpoint: dict) -> bool:
+    """Returns whether the partial download can be resumed with the checkpoint."""
+    part_size = os.stat(part_path).st_size
+    if checkpoint.get('ranges'):
+        # Ranged downloads preallocate the entire file.
+        return part_size == checkpoint['Content-Length']
+    return part_size <= checkpoint['Content-Length']
 
-    # Separated doing the GET and downloading the body of the GET, so that we can cancel
-    # the download in between.
 
-    def perform_get_request() -> requests.Request:
-        headers = {}
+def _resumable_checkpoint(part_path: str, checkpoint_path: str) -> dict:
+    """Returns the checkpoint with which to resume the partial download, or None.
+
+    Checkpoints that can't be used are removed, together with their partial
+    download if that doesn't match the checkpoint.
+    """
+    if not os.path.exists(part_path):
+        return None
+
+    checkpoint = _load_checkpoint(checkpoint_path)
+    if checkpoint is None:
+        _remove_if_exists(checkpoint_path)
+        return None
+    if not _part_matches_checkpoint(part_path, checkpoint):
+        log.info('Partial download %s does not match its checkpoint, starting over.', part_path)
+        _remove_if_exists(part_path, checkpoint_path)
+        return None
+    return checkpoint
+
+
+def _save_checkpoint(checkpoint_path: str, checkpoint: dict):
+    temp_path = checkpoint_path + '~'
+    with with_existing_dir(temp_path, 'w') as outfile:
+        json.dump(checkpoint, outfile, sort_keys=True)
+    os.replace(temp_path, checkpoint_path)
+
+
+def _remove_if_exists(*paths):
+    for path in paths:
         try:
-            if stored_headers['Last-Modified']:
-                headers['If-Modified-Since'] = stored_headers['Last-Modified']
-        except KeyError:
+            os.unlink(path)
+        except FileNotFoundError:
             pass
+
+
+def _move_into_place(part_path: str, filename: str, checkpoint_path: str = None):
+    """Moves the completed download into place, and removes its checkpoint."""
+    os.replace(part_path, filename)
+    if checkpoint_path:
+        _remove_if_exists(checkpoint_path)
+
+
+async def _download_ranged(url, part_path, response, ranges, *,
+                           chunk_size: int,
+                           checkpoint: dict,
+                           checkpoint_path: str,
+                           future: asyncio.Future = None):
+    """Downloads the byte ranges in parallel, writing them into the part file.
+
+    The first range is read from the body of the already-performed GET request,
+    the other ranges are requested separately. The progress of every range is
+    stored in checkpoint['ranges'], and periodically saved to disk, so that the
+    download can be resumed.
+    """
+    loop = asyncio.get_event_loop()
+    validator = _checkpoint_validator(checkpoint)
+    aborted = threading.Event()
+    checkpoint_lock = threading.Lock()
+    last_saved = time.monotonic()
+
+    # Ranges still to download, as [next offset, end] lists that are updated while downloading.
+    checkpoint['ranges'] = progress = [[start, end] for start, end in ranges]
+
+    def save_checkpoint(force=False):
+        nonlocal last_saved
+        with checkpoint_lock:
+            if not force and time.monotonic() - last_saved < DOWNLOAD_CHECKPOINT_INTERVAL_SECS:
+                return
+            _save_checkpoint(checkpoint_path, checkpoint)
+            last_saved = time.monotonic()
+
+    def download_range(range_response, range_progress: list):
+        start, end = range_progress
+        if range_response is None:
+            headers = {'Range': 'bytes=%d-%d' % (start, end - 1),
+                       'Accept-Encoding': 'identity'}
+            if validator:
+                # Don't mix different versions of the file.
+                headers['If-Range'] = validator
+            range_response = download_session.get(url, headers=headers, stream=True, verify=True)
+            range_response.raise_for_status()
+            if range_response.status_code != 206:
+                range_response.close()
+                raise PillarError('Server did not honour range request for %s' % _shorten(url))
+
+        offset = start
+        fd = os.open(part_path, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
         try:
-            if stored_headers['ETag']:
-                headers['If-None-Match'] = stored_headers['ETag']
-        except KeyError:
-            pass
+            with closing(range_response):
+                for block in _iter_adaptive_chunks(range_response, chunk_size):
+                    if is_cancelled(future):
+                        raise asyncio.CancelledError('Downloading was cancelled')
+                    if aborted.is_set():
+                        return
+                    block = block[:end - offset]
+                    _pwrite(fd, block, offset)
+                    offset += len(block)
+                    range_progress[0] = offset
+                    if offset >= end:
+                        break
+                    save_checkpoint()
+        finally:
+            os.close(fd)
+
+        if offset != end:
+            raise PillarError('Download of bytes %d-%d of %s stopped at %d'
+                              % (start, end - 1, _shorten(url), offset))
+
+    def preallocate():
+        size = checkpoint['Content-Length']
+        if os.path.exists(part_path) and os.stat(part_path).st_size == size:
+            return
+        with with_existing_dir(part_path, 'wb') as outfile:
+            outfile.truncate(size)
 
+    log.debug('Downloading %s in %d parallel ranges', _shorten(url), len(ranges))
+    await loop.run_in_executor(None, preallocate)
+    try:
+        await asyncio.gather(*(
+            loop.run_in_executor(None, download_range, response if index == 0 else None,
+                                 range_progress)
+            for index, range_progress in enumerate(progress)))
+    finally:
+        aborted.set()
+        await loop.run_in_executor(None, functools.partial(save_checkpoint, force=True))
+
+
+async def download_to_file(url, filename, *,
+                           header_store: str,
+                           chunk_size=100 * 1024,
+                           file_size: int = None,
+                           priority=Priority.VISIBLE,
+                           future: asyncio.Future = None):
+    """Downloads a file via HTTP(S) directly to the filesystem.
+
+    The download waits for a slot in the download limiter, where waiting downloads
+    are started in order of priority; see _download_to_file() for the other parameters.
+    Concurrent downloads to the same file are performed one after the other, so
+    the later ones usually find the file freshly downloaded already.
+    """
+
+    lock_entry = _download_locks.setdefault(filename, [asyncio.Lock(), 0])
+    lock_entry[1] += 1
+    try:
+        async with lock_entry[0]:
+            # Don't bother checking with the server if we did that recently. The index is
+            # read on a thread, as it waits for the disk and for writes from other threads.
+            loop = asyncio.get_event_loop()
+            if await loop.run_in_executor(None, download_index.is_fresh, url, filename):
+                log.debug('Downloaded %s recently, skipping this request.', url)
+                return
+
+            async with download_limiter.slot(priority):
+                await _download_to_file(url, filename,
+                                        header_store=header_store,
+                                        chunk_size=chunk_size,
+                                        file_size=file_size,
+                                        future=future)
+    finally:
+        lock_entry[1] -= 1
+        if not lock_entry[1]:
+            del _download_locks[filename]
+
+
+async def _download_to_file(url, filename, *,
+                            header_store: str,
+                            chunk_size=100 * 1024,
+                            file_size: int = None,
+                            future: asyncio.Future = None):
+    """Downloads a file via HTTP(S) directly to the filesystem.
+
+    The response is read in chunks of at least chunk_size bytes; on fast connections
+    the chunks grow larger. Chunks are written to disk on a separate thread.
+
+    The download is written to a '.part' file next to the target file, and only
+    moved into place when complete. When the download is cancelled or fails,
+    a checkpoint is kept next to the '.part' file, so that the next call can
+    resume it (if the file didn't change on the server in the mean time).
+
+    :param header_store: path of the '.headers' sidecar file in which older versions
+        of this add-on stored the HTTP headers; it is imported into the download index
+        when the file isn't in there yet.
+    :param file_size: the expected size of the file. When it is at least
+        RANGED_DOWNLOAD_MIN_SIZE and the server supports it, the file is downloaded
+        in multiple byte ranges in parallel.
+    """
+
+    loop = asyncio.get_event_loop()
+    stored_headers = {}
+    # Looking up can import a sidecar file, so this also runs on a thread.
+    entry = None
+    if os.path.exists(filename):
+        entry = await loop.run_in_executor(None, download_index.lookup, filename, header_store)
+    if entry is not None:
+        file_size_on_disk = os.stat(filename).st_size
+        if entry.size != file_size_on_disk:
+            log.debug('File size should be %i but is %i; ignoring cache.',
+                      entry.size, file_size_on_disk)
+        else:
+            stored_headers = {'ETag': entry.etag, 'Last-Modified': entry.last_modified}
+
+    part_path = filename + '.part'
+    checkpoint_path = part_path + '.json'
+    resume_ranges = []
+    # The checkpoint is loaded on a thread, as it waits for the disk.
+    checkpoint = await loop.run_in_executor(None, _resumable_checkpoint,
+                                            part_path, checkpoint_path)
+    resumed = has_checkpoint_file = checkpoint is not None
+    if checkpoint is not None:
+        if checkpoint.get('ranges'):
+            resume_ranges = checkpoint['ranges']
+        else:
+            resume_ranges = [(os.stat(part_path).st_size, checkpoint['Content-Length'])]
+        resume_ranges = [(start, end) for start, end in resume_ranges if start < end]
+        log.debug('Resuming download of %s from checkpoint %s', _shorten(url), checkpoint_path)
+
+    use_async_http = (ASYNC_HTTP_DOWNLOADS
+                      and (not file_size or file_size <= ASYNC_HTTP_MAX_SIZE)
+                      and not (checkpoint and checkpoint.get('ranges'))
+                      and async_http.can_handle(url))
+
+    # Separated doing the GET and downloading the body of the GET, so that we can cancel
+    # the download in between.
+
+    def request_headers() -> dict:
+        # Byte ranges and the Content-Length should refer to the file itself,
+        # not to a compressed version of it.
+        headers = {'Accept-Encoding': 'identity'}
+        if resume_ranges:
+            start, end = resume_ranges[0]
+            headers['Range'] = 'bytes=%d-%d' % (start, end - 1)
+            headers['If-Range'] = _checkpoint_validator(checkpoint)
+        else:
+            try:
+                if stored_headers['Last-Modified']:
+                    headers['If-Modified-Since'] = stored_headers['Last-Modified']
+            except KeyError:
+                pass
+            try:
+                if stored_headers['ETag']:
+                    headers['If-None-Match'] = stored_headers['ETag']
+            except KeyError:
+                pass
+        return headers
+
+    def perform_get_request(headers: dict) -> requests.Request:
         if is_cancelled(future):
             log.debug('Downloading was cancelled before doing the GET.')
             raise asyncio.CancelledError('Downloading was cancelled')
         log.debug('Performing GET request, waiting for response.')
-        return uncached_session.get(url, headers=headers, stream=True, verify=True)
+        return download_session.get(url, headers=headers, stream=True, verify=True)
 
     # Download the file in a different thread.
-    def download_loop():
-        with with_existing_dir(filename, 'wb') as outfile:
+    def download_loop(open_mode: str):
+        with with_existing_dir(part_path, open_mode) as outfile:
             with closing(response):
-                for block in response.iter_content(chunk_size=chunk_size):
-                    if is_cancelled(future):
-                        raise asyncio.CancelledError('Downloading was cancelled')
-                    outfile.write(block)
+                chunks = _iter_adaptive_chunks(response, chunk_size)
+                _write_pipelined(chunks, outfile, future)
 
     # Check for cancellation even before we start our GET request
     if is_cancelled(future):
         log.debug('Downloading was cancelled before doing the GET')
         raise asyncio.CancelledError('Downloading was cancelled')
 
-    log.debug('Performing GET %s', _shorten(url))
-    response = await loop.run_in_executor(None, perform_get_request)
-    log.debug('Status %i from GET %s', response.status_code, _shorten(url))
-    response.raise_for_status()
-
-    if response.status_code == 304:
-        # The file we have cached is still good, just use that instead.
-        _downloaded_urls.add(url)
-        return
+    if checkpoint is not None and not resume_ranges:
+        log.debug('Partial download %s is already complete', part_path)
+    else:
+        log.debug('Performing GET %s', _shorten(url))
+        if use_async_http:
+            response = await async_http.get(url, request_headers())
+        else:
+            response = await loop.run_in_executor(None, perform_get_request, request_headers())
+        log.debug('Status %i from GET %s', response.status_code, _shorten(url))
+        if resume_ranges and response.status_code == 416:
+            log.info('Unable to resume download of %s, starting over.', _shorten(url))
+            response.close()
+            await loop.run_in_executor(None, _remove_if_exists, part_path, checkpoint_path)
+            return await _download_to_file(url, filename,
+                                           header_store=header_store,
+                                           chunk_size=chunk_size,
+                                           file_size=file_size,
+                                           future=future)
+        response.raise_for_status()
+
+        if response.status_code == 304:
+            # The file we have cached is still good, just use that instead.
+            # The index is written on a thread, as it waits for the disk.
+            await loop.run_in_executor(None, download_index.record,
+                                       url, filename, os.stat(filename).st_size,
+                                       stored_headers.get('ETag'),
+                                       stored_headers.get('Last-Modified'))
+            return
 
-    # After we performed the GET request, we should check whether we should start
-    # the download at all.
-    if is_cancelled(future):
-        log.debug('Downloading was cancelled before downloading the GET response')
-        raise asyncio.CancelledError('Downloading was cancelled')
+        # After we performed the GET request, we should check whether we should start
+        # the download at all.
+        if is_cancelled(future):
+            log.debug('Downloading was cancelled before downloading the GET response')
+            raise asyncio.CancelledError('Downloading was cancelled')
 
-    log.debug('Downloading response of GET %s', _shorten(url))
-    await loop.run_in_executor(None, download_loop)
-    log.debug('Done downloading response of GET %s', _shorten(url))
+        if response.status_code != 206:
+            # Either a fresh download, or the file changed since the checkpoint was made.
+            content_length = response.headers.get('Content-Length')
+            if response.headers.get('Content-Encoding', 'identity') != 'identity':
+                # The server compressed the body anyway, so its length isn't the
+                # length of the file. Such a download can't be checked or resumed.
+                content_length = None
+            checkpoint = {
+                'ETag': str(response.headers.get('etag', '')),
+                'Last-Modified': response.headers.get('Last-Modified'),
+                'Content-Length': int(content_length) if content_length else None,
+                'ranges': None,
+            }
+            resume_ranges = _download_ranges(response, file_size) or []
+            if has_checkpoint_file:
+                await loop.run_in_executor(None, _remove_if_exists, checkpoint_path)
+                has_checkpoint_file = False
+
+        log.debug('Downloading response of GET %s', _shorten(url))
+        is_ranged = checkpoint['ranges'] is not None or len(resume_ranges) > 1
+        if is_ranged:
+            has_checkpoint_file = True
+            await _download_ranged(url, part_path, response, resume_ranges,
+                                   chunk_size=chunk_size,
+                                   checkpoint=checkpoint,
+                                   checkpoint_path=checkpoint_path,
+                                   future=future)
+        else:
+            if (not has_checkpoint_file
+                    and (checkpoint['Content-Length'] or 0) >= DOWNLOAD_CHECKPOINT_MIN_SIZE
+                    and _checkpoint_validator(checkpoint)):
+                await loop.run_in_executor(None, _save_checkpoint, checkpoint_path, checkpoint)
+                has_checkpoint_file = True
+            open_mode = 'ab' if response.status_code == 206 else 'wb'
+            if use_async_http:
+                await _download_async(response, part_path, open_mode, chunk_size, future)
+            else:
+                await loop.run_in_executor(None, download_loop, open_mode)
+        log.debug('Done downloading response of GET %s', _shorten(url))
+
+    # Only use the download when it's complete.
+    actual_length = os.stat(part_path).st_size
+    expected_length = checkpoint['Content-Length']
+    if expected_length is not None and actual_length != expected_length:
+        await loop.run_in_executor(None, _remove_if_exists, part_path, checkpoint_path)
+        if resumed:
+            log.info('Resumed download of %s has %d bytes instead of %d, starting over.',
+                     _shorten(url), actual_length, expected_length)
+            return await _download_to_file(url, filename,
+                                           header_store=header_store,
+                                           chunk_size=chunk_size,
+                                           file_size=file_size,
+                                           future=future)
+        raise PillarError('Downloaded %d bytes of %s, but expected %d bytes'
+                          % (actual_length, _shorten(url), expected_length))
+    await loop.run_in_executor(None, _move_into_place, part_path, filename,
+                               checkpoint_path if has_checkpoint_file else None)
 
     # We're done downloading, now we have something cached we can use.
-    log.debug('Saving header cache to %s', header_store)
-    _downloaded_urls.add(url)
+    log.debug('Recording download of %s in the download index', _shorten(url))
+    await loop.run_in_executor(None, download_index.record, url, filename, actual_length,
+                               checkpoint['ETag'], checkpoint['Last-Modified'])
+
+
+def thumbnail_link_from_variations(file: pillarsdk.File, desired_size: str) -> str:
+    """Returns the link of the file's variation of the desired size.
 
-    with with_existing_dir(header_store, 'w') as outfile:
-        json.dump({
-            'ETag': str(response.headers.get('etag', '')),
-            'Last-Modified': response.headers.get('Last-Modified'),
-            'Content-Length': response.headers.get('Content-Length'),
-        }, outfile, sort_keys=True)
+    :returns: the link, or None if the variation (or its link) is not known locally.
+    """
+
+    for variation in file.variations or ():
+        if variation.size == desired_size and variation.link:
+            return variation.link
+    return None
 
 
-async def fetch_thumbnail_info(file: pillarsdk.File, directory: str, desired_size: str):
+async def fetch_thumbnail_info(file: pillarsdk.File, directory: str, desired_size: str,
+                               priority=Priority.VISIBLE):
     """Fetches thumbnail information from Pillar.
 
     @param file: the pillar File object that represents the image whose thumbnail to download.
     @param directory: the directory to save the file to.
     @param desired_size: thumbnail size
+    @param priority: priority of the Pillar call, if one is needed.
     @return: (url, path), where 'url' is the URL to download the thumbnail from, and 'path' is the absolute path of the
         where the thumbnail should be downloaded to. Returns None, None if the task was cancelled before downloading
         finished.
     """
 
-    thumb_link = await pillar_call(file.thumbnail, desired_size)
-
+    # The variations are usually fetched with the File already, saving a call to Pillar.
+    thumb_link = thumbnail_link_from_variations(file, desired_size)
     if thumb_link is None:
+        thumb_link = await pillar_call(file.thumbnail, desired_size, priority=priority)
+
+    if not thumb_link:
         raise ValueError("File {} has no thumbnail of size {}"
                          .format(file['_id'], desired_size))
 
@@ -544,6 +1225,7 @@ async def fetch_texture_thumbs(parent_node_uuid: str, desired_size: str,
                                *,
                                thumbnail_loading: callable,
                                thumbnail_loaded: callable,
+                               visible_nodes: callable = None,
                                future: asyncio.Future = None):
     """Generator, fetches all texture thumbnails in a certain parent node.
 
@@ -555,6 +1237,10 @@ async def fetch_texture_thumbs(parent_node_uuid: str, desired_size: str,
         show a "downloading" indicator.
     @param thumbnail_loaded: callback function that takes (pillarsdk.Node, pillarsdk.File object,
         thumbnail path) parameters, which is called for every thumbnail after it's been downloaded.
+    @param visible_nodes: callback function that takes the list of texture nodes, and returns
+        the set of UUIDs of the nodes whose thumbnails are on screen. The other thumbnails are
+        fetched at PREFETCH priority, after the visible ones. When not given, or when it
+        returns None, all thumbnails are considered visible.
     @param future: Future that's inspected; if it is not None and cancelled, texture downloading
         is aborted.
     """
@@ -568,10 +1254,18 @@ async def fetch_texture_thumbs(parent_node_uuid: str, desired_size: str,
         log.warning('fetch_texture_thumbs: Texture downloading cancelled')
         return
 
+    visible_uuids = visible_nodes(texture_nodes) if visible_nodes else None
+
+    def priority(texture_node) -> Priority:
+        if visible_uuids is None or texture_node['_id'] in visible_uuids:
+            return Priority.VISIBLE
+        return Priority.PREFETCH
+
     coros = (download_texture_thumbnail(texture_node, desired_size,
                                         thumbnail_directory,
                                         thumbnail_loading=thumbnail_loading,
                                         thumbnail_loaded=thumbnail_loaded,
+                                        priority=priority(texture_node),
                                         future=future)
              for texture_node in texture_nodes)
 
@@ -587,6 +1281,7 @@ async def download_texture_thumbnail(texture_node, desired_size: str,
                                      *,
                                      thumbnail_loading: callable,
                                      thumbnail_loaded: callable,
+                                     priority=Priority.VISIBLE,
                                      future: asyncio.Future = None):
     # Skip non-texture nodes, as we can't thumbnail them anyway.
     if texture_node['node_type'] not in TEXTURE_NODE_TYPES:
@@ -616,10 +1311,9 @@ async def download_texture_thumbnail(texture_node, desired_size: str,
 
     # Load the File that belongs to this texture node's picture.
     loop.call_soon_threadsafe(thumbnail_loading, texture_node, texture_node)
-    file_desc = await pillar_call(pillarsdk.File.find, pic_uuid, params={
-        'projection': {'filename': 1, 'variations': 1, 'width': 1, 'height': 1,
-                       'length': 1},
-    })
+    file_desc = await find_file_doc(pic_uuid, {'filename': 1, 'variations': 1, 'width': 1,
+                                               'height': 1, 'length': 1},
+                                    priority=priority)
 
     if file_desc is None:
         log.warning('Unable to find file for texture node %s', pic_uuid)
@@ -632,18 +1326,19 @@ async def download_texture_thumbnail(texture_node, desired_size: str,
 
         # Get the thumbnail information from Pillar
         thumb_url, thumb_path = await fetch_thumbnail_info(file_desc, thumbnail_directory,
-                                                           desired_size)
+                                                           desired_size, priority)
         if thumb_path is None:
             # The task got cancelled, we should abort too.
             log.debug('fetch_texture_thumbs cancelled while downloading file %r',
                       file_desc['_id'])
             return
 
-        # Cached headers are stored next to thumbnails in sidecar files.
+        # Older versions stored the cached headers in this sidecar file.
         header_store = '%s.headers' % thumb_path
 
         try:
-            await download_to_file(thumb_url, thumb_path, header_store=header_store, future=future)
+            await download_to_file(thumb_url, thumb_path, header_store=header_store,
+                                   priority=priority, future=future)
         except requests.exceptions.HTTPError as ex:
             log.error('Unable to download %s: %s', thumb_url, ex)
             thumb_path = 'ERROR'
@@ -699,10 +1394,8 @@ async def download_file_doc(file_id,
 
     # Load the File that belongs to this texture node's picture.
     loop.call_soon_threadsafe(file_doc_loading, file_id)
-    file_desc = await pillar_call(pillarsdk.File.find, file_id, params={
-        'projection': {'filename': 1, 'variations': 1, 'width': 1, 'height': 1,
-                       'length': 1},
-    })
+    file_desc = await find_file_doc(file_id, {'filename': 1, 'variations': 1, 'width': 1,
+                                              'height': 1, 'length': 1})
 
     if file_desc is None:
         log.warning('Unable to find File for file_id %s', file_id)
@@ -719,11 +1412,15 @@ async def download_file_by_uuid(file_uuid,
                                 file_loading: callable = None,
                                 file_loaded: callable = None,
                                 file_loaded_sync: callable = None,
+                                priority=Priority.INTERACTIVE,
                                 future: asyncio.Future):
     """Downloads a file from Pillar by its UUID.
 
     :param filename: overrules the filename in file_doc['filename'] if given.
         The extension from file_doc['filename'] is still used, though.
+    :param priority: priority of the download itself; looking up the File
+        document is always interactive. The default suits downloads that the
+        user is waiting for; pass BACKGROUND for downloads nobody waits for.
     """
     if is_cancelled(future):
         log.debug('download_file_by_uuid(%r) cancelled.', file_uuid)
@@ -755,11 +1452,12 @@ async def download_file_by_uuid(file_uuid,
     if file_loading is not None:
         loop.call_soon_threadsafe(file_loading, file_path, file_desc, map_type)
 
-    # Cached headers are stored in the project space
+    # Older versions stored the cached headers in this sidecar file, in the project space.
     header_store = os.path.join(metadata_directory, 'files',
                                 sanitize_filename('%s.headers' % file_uuid))
 
-    await download_to_file(file_url, file_path, header_store=header_store, future=future)
+    await download_to_file(file_url, file_path, header_store=header_store,
+                           file_size=file_desc['length'], priority=priority, future=future)
 
     if file_loaded is not None:
         loop.call_soon_threadsafe(file_loaded, file_path, file_desc, map_type)
@@ -773,6 +1471,7 @@ async def download_texture(texture_node,
                            *,
                            texture_loading: callable,
                            texture_loaded: callable,
+                           priority=Priority.INTERACTIVE,
                            future: asyncio.Future):
     node_type_name = texture_node['node_type']
     if node_type_name not in TEXTURE_NODE_TYPES:
@@ -791,6 +1490,7 @@ async def download_texture(texture_node,
                                     map_type=file_info.map_type or file_info.resolution,
                                     file_loading=texture_loading,
                                     file_loaded=texture_loaded,
+                                    priority=priority,
                                     future=future)
         downloaders.append(dlr)
 
@@ -477,6 +477,7 @@ class PILLAR_OT_sync(pillar.PillarOperatorMixin,
                                            temp_dir,
                                            str(meta_path),
                                            file_loaded_sync=file_downloaded,
+                                           priority=pillar.Priority.INTERACTIVE,
                                            future=self.signalling_future)
 
     def move_file(self, src, dst):
@@ -515,14 +516,17 @@ class PILLAR_OT_sync(pillar.PillarOperatorMixin,
         log.debug('Overriding values: %s', remembered)
 
         # Rewrite the userprefs.blend file to override the options.
-        with blendfile.open_blend(file_path, 'rb+') as blend:
-            prefs = next(block for block in blend.blocks
-                         if block.code == b'USER')
+        with blendfile.open_blend(file_path, 'rb+', lazy=True) as blend:
+            prefs = blend.find_first_block_from_code(b'USER')
+            if prefs is None:
+                self.log.warning('No USER block in %s, not overriding local settings',
+                                 file_path)
+                return
 
             for key, value in remembered.items():
                 self.log.debug('prefs[%r] = %r' % (key, prefs[key]))
                 self.log.debug('  -> setting prefs[%r] = %r' % (key, value))
-                prefs[key] = value
+            prefs.set_many(remembered)
 
 
 def register():
@@ -79,6 +79,7 @@ class BlenderCloudBrowser(pillar.PillarOperatorMixin,
     scroll_offset_target = 0
     scroll_offset_max = 0
     scroll_offset_space_left = 0
+    items_per_page = 0  # Number of menu items that fit on screen, updated when drawing.
 
     def invoke(self, context, event):
         # Refuse to start if the file hasn't been saved. It's okay if
@@ -369,9 +370,24 @@ class BlenderCloudBrowser(pillar.PillarOperatorMixin,
             self.log.debug('Node %s thumbnail loaded', node['_id'])
             self.update_menu_item(node, file_desc, thumb_path)
 
+        def visible_nodes(texture_nodes):
+            if not self.items_per_page:
+                # Not drawn yet, so we don't know what fits on screen.
+                return None
+
+            # The view was scrolled to the top, and the textures are shown after the folders.
+            free_items = max(0, self.items_per_page - len(self.current_display_content))
+
+            def sort_key(node):
+                return menu_item_mod.MenuItem.node_sort_key(node, node['name'])
+
+            on_screen = sorted(texture_nodes, key=sort_key)[:free_items]
+            return {node['_id'] for node in on_screen}
+
         await pillar.fetch_texture_thumbs(node_uuid, 's', directory,
                                           thumbnail_loading=thumbnail_loading,
                                           thumbnail_loaded=thumbnail_loaded,
+                                          visible_nodes=visible_nodes,
                                           future=self.signalling_future)
 
     def browse_assets(self):
@@ -441,6 +457,7 @@ class BlenderCloudBrowser(pillar.PillarOperatorMixin,
         # The -1 / +2 are for extra rows that are drawn only half at the top/bottom.
         first_item_idx = max(0, int(-self.scroll_offset // block_height - 1) * col_count)
         items_per_page = int(content_height // item_height + 2) * col_count
+        self.items_per_page = items_per_page
         last_item_idx = first_item_idx + items_per_page
 
         for item_idx, item in enumerate(self.current_display_content):
@@ -737,6 +754,7 @@ class PILLAR_OT_switch_hdri(pillar.PillarOperatorMixin,
                                            map_type=resolution,
                                            file_loading=file_loading,
                                            file_loaded_sync=file_loaded,
+                                           priority=pillar.Priority.INTERACTIVE,
                                            future=self.signalling_future)
 
         self.report({'INFO'}, 'Image download complete')
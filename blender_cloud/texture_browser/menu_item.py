@@ -57,11 +57,7 @@ class MenuItem:
         self._is_folder = node['node_type'] in self.FOLDER_NODE_TYPES
         self._is_spinning = False
 
-        # Determine sorting order.
-        # by default, sort all the way at the end and folders first.
-        self._order = 0 if self._is_folder else 10000
-        if node and node.properties and node.properties.order is not None:
-            self._order = node.properties.order
+        self._order, _ = self.node_sort_key(node, label_text)
 
         self.thumb_path = thumb_path
 
@@ -95,6 +91,17 @@ class MenuItem:
         """Key for sorting lists of MenuItems."""
         return self._order, self.label_text
 
+    @classmethod
+    def node_sort_key(cls, node, label_text):
+        """Key with which the MenuItem of the node would be sorted."""
+
+        # Determine sorting order.
+        # by default, sort all the way at the end and folders first.
+        order = 0 if node['node_type'] in cls.FOLDER_NODE_TYPES else 10000
+        if node and node.properties and node.properties.order is not None:
+            order = node.properties.order
+        return order, label_text
+
     @property
     def thumb_path(self) -> str:
         return self._thumb_path
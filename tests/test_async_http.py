@@ -0,0 +1,145 @@
+"""Unittests for blender_cloud.async_http.
+
+These run against a minimal HTTP/1.1 server on localhost.
+"""
+
+import asyncio
+import http.server
+import threading
+import time
+import unittest.mock
+
+import requests.exceptions
+
+from blender_cloud import async_http
+
+BODY = b'0123456789abcdef' * 1024
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.requests_on_connection = 0
+        with self.server.lock:
+            self.server.connection_count += 1
+
+    def do_GET(self):
+        self.requests_on_connection += 1
+
+        if self.path == '/stale' and self.requests_on_connection > 1:
+            # Like a server whose idle timeout just expired: close without responding.
+            self.close_connection = True
+            return
+
+        if self.path == '/chunked':
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for start in range(0, len(BODY), 3000):
+                chunk = BODY[start:start + 3000]
+                self.wfile.write(b'%x;ext=1\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\nX-Trailer: yes\r\n\r\n')
+            return
+
+        if self.path == '/redirect':
+            self._send(302, b'moved', {'Location': '/file'})
+            return
+
+        if self.path == '/slow':
+            time.sleep(1)
+
+        self._send(200, BODY)
+
+    def _send(self, status: int, body: bytes, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class AsyncHTTPTest(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.connection_count = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.loop = asyncio.new_event_loop()
+        self.pool = async_http.ConnectionPool()
+
+    def tearDown(self):
+        self.pool.close()
+        self.loop.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, path: str) -> str:
+        return 'http://127.0.0.1:%d%s' % (self.server.server_port, path)
+
+    def get(self, path: str) -> (async_http.Response, bytes):
+        async def get():
+            response = await self.pool.get(self.url(path), {})
+            body = bytearray()
+            while True:
+                block = await response.read(1000)
+                if not block:
+                    break
+                body += block
+            return response, bytes(body)
+
+        return self.loop.run_until_complete(get())
+
+    def test_content_length(self):
+        response, body = self.get('/file')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(BODY, body)
+
+    def test_chunked(self):
+        response, body = self.get('/chunked')
+        self.assertEqual(BODY, body)
+
+        # The trailer was skipped, so that the connection can be reused.
+        response, body = self.get('/file')
+        self.assertEqual(BODY, body)
+        self.assertEqual(1, self.server.connection_count)
+
+    def test_keep_alive(self):
+        for _ in range(3):
+            response, body = self.get('/file')
+            self.assertEqual(BODY, body)
+        self.assertEqual(1, self.server.connection_count)
+
+    def test_redirect(self):
+        response, body = self.get('/redirect')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.url('/file'), response.url)
+        self.assertEqual(BODY, body)
+        self.assertEqual(1, self.server.connection_count)
+
+    def test_stale_idle_connection(self):
+        self.get('/stale')
+        response, body = self.get('/stale')
+
+        self.assertEqual(BODY, body)
+        self.assertEqual(2, self.server.connection_count)
+
+    def test_timeout(self):
+        with unittest.mock.patch.object(async_http, 'READ_TIMEOUT_SECS', 0.1):
+            with self.assertRaises(requests.exceptions.Timeout):
+                self.get('/slow')
+
+    def test_connection_refused(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+        with self.assertRaises(requests.exceptions.ConnectionError) as context:
+            self.get('/file')
+        self.assertNotIsInstance(context.exception, requests.exceptions.Timeout)
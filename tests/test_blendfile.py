@@ -0,0 +1,413 @@
+"""Unittests for blender_cloud.blendfile.
+
+The blend file used here is synthesised by the test itself, so that it is
+small and its contents are known exactly.
+"""
+
+import gzip
+import pathlib
+import struct
+import tempfile
+import unittest.mock
+
+from blender_cloud import blendfile
+
+# (type name, size) -- sizes of structs are computed from their fields.
+TYPES = [(b'char', 1), (b'short', 2), (b'int', 4), (b'float', 4), (b'void', 0),
+         (b'ListBase', 0), (b'ID', 0), (b'UserDef', 0), (b'Image', 0)]
+STRUCTS = [
+    (b'ListBase', [(b'void', b'*first'), (b'void', b'*last')]),
+    (b'ID', [(b'void', b'*next'), (b'void', b'*prev'), (b'char', b'name[66]'),
+             (b'short', b'flag'), (b'int', b'us')]),
+    (b'UserDef', [(b'int', b'versionfile'), (b'short', b'dpi'), (b'short', b'pad'),
+                  (b'float', b'ui_scale'), (b'char', b'tempdir[768]'),
+                  (b'ListBase', b'themes'), (b'float', b'color[4]'),
+                  (b'int', b'*int_ptr'), (b'char', b'*char_ptr')]),
+    (b'Image', [(b'ID', b'id'), (b'char', b'name[1024]'), (b'Image', b'*next_image')]),
+]
+ID_FORMAT = '<QQ66shi'
+USERDEF_FORMAT = '<ihhf768sQQ4fQQ'
+IMAGE_FORMAT = ID_FORMAT + '1024sQ'
+
+
+def _pad4(data: bytes) -> bytes:
+    return data + b'\0' * (-len(data) % 4)
+
+
+def _sdna() -> bytes:
+    names = [name for _, fields in STRUCTS for _, name in fields]
+    type_names = [name for name, _ in TYPES]
+    sizes = dict(TYPES)
+    for struct_name, fields in STRUCTS:
+        size = 0
+        for field_type, field_name in fields:
+            count = 1
+            for dim in field_name.replace(b']', b'').split(b'[')[1:]:
+                count *= int(dim)
+            size += count * (8 if field_name.startswith(b'*') else sizes[field_type])
+        sizes[struct_name] = size
+
+    sdna = _pad4(b'SDNANAME' + struct.pack('<i', len(names)) +
+                 b''.join(name + b'\0' for name in names))
+    sdna = _pad4(sdna + b'TYPE' + struct.pack('<i', len(type_names)) +
+                 b''.join(name + b'\0' for name in type_names))
+    sdna = _pad4(sdna + b'TLEN' + b''.join(struct.pack('<H', sizes[name]) for name in type_names))
+    sdna += b'STRC' + struct.pack('<i', len(STRUCTS))
+    for struct_name, fields in STRUCTS:
+        sdna += struct.pack('<HH', type_names.index(struct_name), len(fields))
+        for field_type, field_name in fields:
+            sdna += struct.pack('<HH', type_names.index(field_type), names.index(field_name))
+    return sdna
+
+
+def _block(code: bytes, data: bytes, addr_old: int, sdna_index: int, count=1) -> bytes:
+    return struct.pack('<4sIQII', code, len(data), addr_old, sdna_index, count) + data
+
+
+def write_test_blend(path: pathlib.Path):
+    """Writes a 64-bit little-endian blend file with a USER block and two images."""
+
+    sdna_index = {name: index for index, (name, _) in enumerate(STRUCTS)}
+    user = struct.pack(USERDEF_FORMAT, 280, 72, 0, 1.5, b'/tmp/', 0x5000, 0x5000,
+                       0.1, 0.2, 0.3, 1.0, 0, 0)
+    image_1 = struct.pack(IMAGE_FORMAT, 0x4100, 0, b'IMfirst', 0, 1, b'//first.png', 0x4100)
+    image_2 = struct.pack(IMAGE_FORMAT, 0, 0x4000, b'IMsecond', 0, 1, b'//second.png', 0)
+
+    path.write_bytes(b''.join([
+        b'BLENDER-v280',
+        _block(b'REND', b'\1' * 32, 0x1000, 0),
+        _block(b'USER', user, 0x2000, sdna_index[b'UserDef']),
+        _block(b'IM', image_1, 0x4000, sdna_index[b'Image']),
+        _block(b'IM', image_2, 0x4100, sdna_index[b'Image']),
+        _block(b'DATA', struct.pack('<4Q', 0x4000, 0x4100, 0, 0), 0x5000,
+               sdna_index[b'ListBase'], count=2),
+        _block(b'DNA1', _sdna(), 0x6000, 0),
+        struct.pack('<4sIQII', b'ENDB', 0, 0, 0, 0),
+    ]))
+
+
+class AbstractBlendFileTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.blend_path = pathlib.Path(self._tmpdir.name) / 'test.blend'
+        write_test_blend(self.blend_path)
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+
+class ReadTest(AbstractBlendFileTest):
+    def _test_read(self, **open_kwargs):
+        with blendfile.open_blend(str(self.blend_path), 'rb', **open_kwargs) as bfile:
+            self.assertEqual([b'REND', b'USER', b'IM', b'IM', b'DATA', b'DNA1', b'ENDB'],
+                             [block.code for block in bfile.blocks])
+
+            user = bfile.find_blocks_from_code(b'USER')[0]
+            self.assertEqual(280, user[b'versionfile'])
+            self.assertEqual(72, user[b'dpi'])
+            self.assertEqual(1.5, user[b'ui_scale'])
+            self.assertEqual(b'/tmp/', user[b'tempdir'])
+            self.assertEqual('/tmp/', user.get(b'tempdir'))
+            self.assertEqual(4, len(user[b'color']))
+            self.assertEqual(0x5000, user[b'themes', b'first'])
+            self.assertEqual(0x5000, user.get_pointer((b'themes', b'last')).addr_old)
+
+            first, second = bfile.find_blocks_from_code(b'IM')
+            self.assertEqual(b'IMfirst', first[b'id', b'name'])
+            self.assertEqual(b'//second.png', second[b'name'])
+            self.assertIs(second, first.get_pointer(b'next_image'))
+            self.assertIsNone(second.get_pointer(b'next_image'))
+            self.assertEqual((second.file_offset + 88, 1024), second.get_file_offset(b'name'))
+
+            self.assertEqual('fallback', first.get(b'nonexistant', default='fallback'))
+            self.assertRaises(KeyError, first.get, b'nonexistant')
+
+    def test_field_codecs(self):
+        with blendfile.open_blend(str(self.blend_path)) as bfile:
+            userdef = bfile.structs[bfile.sdna_index_from_id[b'UserDef']]
+            codecs = {field.dna_name.name_only: field.codec for field in userdef.fields}
+
+        self.assertEqual('<i', codecs[b'versionfile'].format)
+        self.assertEqual('<768s', codecs[b'tempdir'].format)
+        self.assertEqual('<4f', codecs[b'color'].format)
+        self.assertIsNone(codecs[b'themes'])
+
+    def _test_decode(self, **open_kwargs):
+        with blendfile.open_blend(str(self.blend_path), 'rb', **open_kwargs) as bfile:
+            first = bfile.find_blocks_from_code(b'IM')[0].decode()
+            self.assertEqual(b'IMfirst', first.id.name)
+            self.assertEqual(b'IMfirst', first[b'id'][b'name'])
+            self.assertEqual(b'//first.png', first[b'name'])
+            self.assertEqual(0x4100, first.next_image)
+
+            user = bfile.find_blocks_from_code(b'USER')[0].decode()
+            self.assertEqual((0x5000, 0x5000), user.themes)
+            self.assertEqual([0.3, 1.0], [round(v, 1) for v in user.color[2:]])
+
+            listbases = bfile.find_blocks_from_code(b'DATA')[0].decode_all()
+            self.assertEqual([(0x4000, 0x4100), (0, 0)], listbases)
+            self.assertEqual({'first': 0x4000, 'last': 0x4100}, listbases[0]._asdict())
+
+    def test_decode_through_handle(self):
+        self._test_decode()
+
+    def test_decode_mmap(self):
+        self._test_decode(use_mmap=True)
+
+    def test_read_through_handle(self):
+        self._test_read()
+
+    def test_read_mmap(self):
+        self._test_read(use_mmap=True)
+
+    def test_path_cache(self):
+        with blendfile.open_blend(str(self.blend_path)) as bfile:
+            first, second = bfile.find_blocks_from_code(b'IM')
+            image = bfile.structs[first.sdna_index]
+            with unittest.mock.patch.object(blendfile.DNAStruct, 'resolve_path', autospec=True,
+                                            side_effect=blendfile.DNAStruct.resolve_path) \
+                    as resolve_path:
+                self.assertEqual(b'IMfirst', first[b'id', b'name'])
+                self.assertEqual(b'IMsecond', second[b'id', b'name'])
+                self.assertIsNone(second.get_pointer(b'next_image'))
+                self.assertEqual('fallback', first.get(b'nonexistant', default='fallback'))
+                self.assertEqual('fallback', second.get(b'nonexistant', default='fallback'))
+
+            # (b'id', b'name') is resolved by both Image and ID.
+            self.assertEqual(4, resolve_path.call_count)
+            field, offset = image.path_cache[b'id', b'name']
+            self.assertEqual(b'name', field.dna_name.name_only)
+            self.assertEqual(16, offset)
+
+    def test_data_ranges(self):
+        with blendfile.open_blend(str(self.blend_path)) as bfile:
+            structs = {dna_struct.dna_type_id: dna_struct for dna_struct in bfile.structs}
+
+        self.assertEqual(((0, 780), (796, 812)), structs[b'UserDef'].get_data_ranges())
+        self.assertEqual(((16, 1112),), structs[b'Image'].get_data_ranges())
+        self.assertEqual((), structs[b'ListBase'].get_data_ranges())
+
+    def test_data_hash_skips_pointers(self):
+        with blendfile.open_blend(str(self.blend_path)) as bfile:
+            user = bfile.find_blocks_from_code(b'USER')[0]
+            original_hash = user.get_data_hash()
+            themes_offset = user.get_file_offset(b'themes')[0]
+            version_offset = user.get_file_offset(b'versionfile')[0]
+
+        with self.blend_path.open('rb+') as outfile:
+            outfile.seek(themes_offset)
+            outfile.write(struct.pack('<Q', 0xdead))
+        with blendfile.open_blend(str(self.blend_path)) as bfile:
+            user = bfile.find_blocks_from_code(b'USER')[0]
+            self.assertEqual(original_hash, user.get_data_hash())
+
+        with self.blend_path.open('rb+') as outfile:
+            outfile.seek(version_offset)
+            outfile.write(struct.pack('<i', 281))
+        with blendfile.open_blend(str(self.blend_path)) as bfile:
+            user = bfile.find_blocks_from_code(b'USER')[0]
+            self.assertNotEqual(original_hash, user.get_data_hash())
+
+    def test_pointer_graph(self):
+        with blendfile.open_blend(str(self.blend_path), lazy=True) as bfile:
+            graph = bfile.get_pointer_graph()
+            self.assertIs(graph, bfile.get_pointer_graph())
+
+            user = bfile.find_first_block_from_code(b'USER')
+            listbase = bfile.find_first_block_from_code(b'DATA')
+            first, second = bfile.find_blocks_from_code(b'IM')
+
+            self.assertEqual([listbase], graph.targets(user))
+            self.assertEqual([first, second], graph.targets(listbase))
+            self.assertEqual([second], graph.targets(first))
+            self.assertEqual([first], graph.targets(second))
+
+            self.assertEqual([user, listbase, first, second], graph.reachable_from([user]))
+            self.assertEqual([first, second], graph.reachable_from([first], depth_first=True))
+            self.assertEqual([user, listbase], graph.unreachable([second]))
+
+
+class LazyReadTest(AbstractBlendFileTest):
+    def _test_lazy(self, **open_kwargs):
+        with blendfile.open_blend(str(self.blend_path), 'rb', lazy=True, **open_kwargs) as bfile:
+            self.assertEqual([], bfile.blocks)
+            self.assertIsNotNone(bfile.structs)
+
+            user = bfile.find_first_block_from_code(b'USER')
+            self.assertEqual([b'REND', b'USER'], [block.code for block in bfile.blocks])
+            self.assertEqual(280, user[b'versionfile'])
+
+            # Following a pointer requires the full index.
+            self.assertEqual(0x5000, user.get_pointer((b'themes', b'first')).addr_old)
+            self.assertEqual(7, len(bfile.blocks))
+            self.assertIsNone(bfile.find_first_block_from_code(b'XXXX'))
+            self.assertEqual(2, len(bfile.find_blocks_from_code(b'IM')))
+
+    def test_lazy_through_handle(self):
+        self._test_lazy()
+
+    def test_lazy_mmap(self):
+        self._test_lazy(use_mmap=True)
+
+
+class DNACacheTest(AbstractBlendFileTest):
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = pathlib.Path(self._tmpdir.name) / 'dna-cache'
+        blendfile.dna_cache_directory = str(self.cache_dir)
+        blendfile._dna_cache.clear()
+
+    def tearDown(self):
+        blendfile.dna_cache_directory = None
+        blendfile._dna_cache.clear()
+        super().tearDown()
+
+    def test_memory_cache(self):
+        with blendfile.open_blend(str(self.blend_path)) as bfile:
+            structs = bfile.structs
+        with blendfile.open_blend(str(self.blend_path), lazy=True) as bfile:
+            self.assertIs(structs, bfile.structs)
+
+    def test_disk_cache(self):
+        with blendfile.open_blend(str(self.blend_path)):
+            pass
+        self.assertEqual(1, len(list(self.cache_dir.glob('dna-v*.pickle'))))
+
+        blendfile._dna_cache.clear()
+        with unittest.mock.patch('blender_cloud.blendfile.BlendFile.decode_structs') as decode:
+            with blendfile.open_blend(str(self.blend_path)) as bfile:
+                user = bfile.find_blocks_from_code(b'USER')[0]
+                self.assertEqual(280, user[b'versionfile'])
+        decode.assert_not_called()
+
+    def test_evict_other_versions(self):
+        self.cache_dir.mkdir()
+        old_version = self.cache_dir / 'dna-v0-1234.pickle'
+        old_version.touch()
+
+        with blendfile.open_blend(str(self.blend_path)):
+            pass
+        self.assertFalse(old_version.exists())
+
+
+class WriteTest(AbstractBlendFileTest):
+    def test_set_int_and_string(self):
+        with blendfile.open_blend(str(self.blend_path), 'rb+') as bfile:
+            user = bfile.find_blocks_from_code(b'USER')[0]
+            user[b'versionfile'] = 281
+            user[b'tempdir'] = '/var/tmp'
+
+        with blendfile.open_blend(str(self.blend_path), 'rb', use_mmap=True) as bfile:
+            user = bfile.find_blocks_from_code(b'USER')[0]
+            self.assertEqual(281, user[b'versionfile'])
+            self.assertEqual(b'/var/tmp', user[b'tempdir'])
+
+    def _test_set_many(self, **open_kwargs):
+        with blendfile.open_blend(str(self.blend_path), 'rb+', **open_kwargs) as bfile:
+            user = bfile.find_blocks_from_code(b'USER')[0]
+            user.set_many({
+                b'color': [0.5, 0.5, 0.5, 1.0],
+                b'dpi': 96,
+                b'ui_scale': 2.0,
+                b'tempdir': '/var/tmp',
+                (b'themes', b'last'): 0x4000,
+                b'versionfile': 281,
+            })
+            self.assertRaises(KeyError, user.set_many, {b'dpi': 100, b'nonexistant': 1})
+
+        with blendfile.open_blend(str(self.blend_path), 'rb') as bfile:
+            user = bfile.find_blocks_from_code(b'USER')[0].decode()
+            self.assertEqual(281, user.versionfile)
+            self.assertEqual(96, user.dpi)
+            self.assertEqual(2.0, user.ui_scale)
+            self.assertEqual(b'/var/tmp', user.tempdir)
+            self.assertEqual((0x5000, 0x4000), user.themes)
+            self.assertEqual([0.5, 0.5, 0.5, 1.0], user.color)
+
+    def test_set_pointer_to_primitive(self):
+        # Addresses above 2**32 need all 8 bytes of the pointer.
+        int_addr, char_addr = 0x7f0012345678, 0x7f00abcdef00
+        with blendfile.open_blend(str(self.blend_path), 'rb+') as bfile:
+            user = bfile.find_blocks_from_code(b'USER')[0]
+            user.set_many({b'int_ptr': int_addr, b'char_ptr': char_addr})
+
+        with blendfile.open_blend(str(self.blend_path), 'rb') as bfile:
+            user = bfile.find_blocks_from_code(b'USER')[0]
+            self.assertEqual(int_addr, user[b'int_ptr'])
+            self.assertEqual(char_addr, user[b'char_ptr'])
+            self.assertEqual(0.1, round(user[b'color'][0], 1))
+
+    def test_set_many_through_handle(self):
+        self._test_set_many()
+
+    def test_set_many_mmap(self):
+        self._test_set_many(use_mmap=True)
+
+
+class StreamedGzipTest(AbstractBlendFileTest):
+    def setUp(self):
+        super().setUp()
+        raw = self.blend_path.read_bytes()
+        with gzip.open(str(self.blend_path), 'wb') as outfile:
+            outfile.write(raw)
+
+    def test_read_loaded_codes(self):
+        with blendfile.open_blend(str(self.blend_path), 'rb', load_codes={b'USER'}) as bfile:
+            self.assertTrue(bfile.is_compressed)
+            user = bfile.find_blocks_from_code(b'USER')[0]
+            self.assertIsNotNone(user.data)
+            self.assertEqual(280, user[b'versionfile'])
+
+            # Blocks that weren't loaded are still readable through the stream.
+            second = bfile.find_blocks_from_code(b'IM')[1]
+            self.assertIsNone(second.data)
+            self.assertEqual(b'//second.png', second[b'name'])
+
+            with self.assertRaisesRegex(PermissionError, 'read-only'):
+                user.set(b'versionfile', 281)
+            with self.assertRaisesRegex(PermissionError, 'read-only'):
+                user.set_many({b'versionfile': 281})
+            self.assertFalse(bfile.is_modified)
+
+    def test_write_loaded_codes(self):
+        with gzip.open(str(self.blend_path)) as infile:
+            original = infile.read()
+
+        with blendfile.open_blend(str(self.blend_path), 'rb+', load_codes={b'USER'}) as bfile:
+            user = bfile.find_blocks_from_code(b'USER')[0]
+            user[b'versionfile'] = 281
+
+        with gzip.open(str(self.blend_path)) as infile:
+            modified = infile.read()
+        self.assertEqual(len(original), len(modified))
+        self.assertEqual(1, sum(a != b for a, b in zip(original, modified)))
+
+        with blendfile.open_blend(str(self.blend_path)) as bfile:
+            user = bfile.find_blocks_from_code(b'USER')[0]
+            self.assertEqual(281, user[b'versionfile'])
+
+
+class ScanManyTest(AbstractBlendFileTest):
+    def test_scan_many(self):
+        gzipped_path = self.blend_path.with_name('gzipped.blend')
+        with gzip.open(str(gzipped_path), 'wb') as outfile:
+            outfile.write(self.blend_path.read_bytes())
+        broken_path = self.blend_path.with_name('broken.blend')
+        broken_path.write_bytes(b'not a blend file')
+
+        filepaths = [str(self.blend_path), str(gzipped_path), str(broken_path)]
+        summaries = {summary.filepath: summary
+                     for summary in blendfile.scan_many(filepaths, max_workers=2)}
+        self.assertEqual(set(filepaths), set(summaries))
+
+        for filepath in filepaths[:2]:
+            summary = summaries[filepath]
+            self.assertIsNone(summary.error)
+            self.assertEqual({b'REND': 1, b'USER': 1, b'IM': 2, b'DATA': 1, b'DNA1': 1},
+                             summary.block_counts)
+            self.assertEqual({b'LI': [], b'IM': [b'//first.png', b'//second.png']},
+                             summary.paths)
+
+        broken = summaries[str(broken_path)]
+        self.assertIn('not a blend', broken.error)
+        self.assertEqual({}, broken.block_counts)
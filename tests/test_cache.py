@@ -0,0 +1,35 @@
+"""Unittests for the HTTP adapters of blender_cloud.cache."""
+
+import unittest.mock
+
+import requests
+import requests.adapters
+
+from blender_cloud import cache
+
+
+class HTTPAdapterTest(unittest.TestCase):
+    def setUp(self):
+        patcher = unittest.mock.patch.object(requests.adapters.HTTPAdapter, 'send',
+                                             autospec=True)
+        self.send = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.adapter = cache.http_adapter(2)
+
+    def sent_timeout(self, request: requests.Request, **send_kwargs):
+        self.adapter.send(request.prepare(), **send_kwargs)
+        return self.send.call_args[1]['timeout']
+
+    def test_default_timeout(self):
+        request = requests.Request('GET', 'https://cloud.blender.org/api/nodes')
+        self.assertEqual(cache.HTTP_TIMEOUT_SECS, self.sent_timeout(request))
+        self.assertEqual(5, self.sent_timeout(request, timeout=5))
+
+    def test_no_default_timeout_for_uploads(self):
+        request = requests.Request('POST', 'https://cloud.blender.org/api/storage/stream',
+                                   files={'file': ('tex.png', b'PNG')})
+        self.assertIsNone(self.sent_timeout(request))
+
+    def test_read_retries(self):
+        self.assertEqual(cache.HTTP_MAX_RETRIES, self.adapter.max_retries.total)
+        self.assertEqual(cache.HTTP_MAX_READ_RETRIES, self.adapter.max_retries.read)
@@ -0,0 +1,190 @@
+"""Unittests for blender_cloud.http2.
+
+These run against a minimal HTTP/2 server on localhost, which speaks cleartext
+HTTP/2 with prior knowledge. They are skipped when httpx and h2 are not installed.
+"""
+
+import concurrent.futures
+import email.utils
+import json
+import socket
+import threading
+import unittest
+
+import cachecontrol
+import cachecontrol.cache
+import requests
+
+from blender_cloud import cache, http2
+
+if http2.is_available():
+    import h2.config
+    import h2.connection
+    import h2.events
+
+
+class LocalHTTP2Server:
+    """Answers every request with a JSON description of that request."""
+
+    def __init__(self):
+        self.request_count = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+        self.connection_count = 0
+        self.lock = threading.Lock()
+
+    def url(self, path: str) -> str:
+        return 'http://127.0.0.1:%d%s' % (self.port, path)
+
+    def start(self):
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def stop(self):
+        self.sock.close()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            with self.lock:
+                self.connection_count += 1
+                connection_nr = self.connection_count
+            threading.Thread(target=self._handle, args=(conn, connection_nr), daemon=True).start()
+
+    def _handle(self, conn: socket.socket, connection_nr: int):
+        config = h2.config.H2Configuration(client_side=False, header_encoding='utf-8')
+        h2conn = h2.connection.H2Connection(config=config)
+        h2conn.initiate_connection()
+        conn.sendall(h2conn.data_to_send())
+
+        requests_by_stream = {}
+        with conn:
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    return
+                for event in h2conn.receive_data(data):
+                    if isinstance(event, h2.events.RequestReceived):
+                        requests_by_stream[event.stream_id] = (dict(event.headers), bytearray())
+                    elif isinstance(event, h2.events.DataReceived):
+                        requests_by_stream[event.stream_id][1].extend(event.data)
+                        h2conn.acknowledge_received_data(event.flow_controlled_length,
+                                                         event.stream_id)
+                    elif isinstance(event, h2.events.StreamEnded):
+                        headers, body = requests_by_stream.pop(event.stream_id)
+                        with self.lock:
+                            self.request_count += 1
+                        self._respond(h2conn, event.stream_id, connection_nr, headers, body)
+                    elif isinstance(event, h2.events.ConnectionTerminated):
+                        conn.sendall(h2conn.data_to_send())
+                        return
+                conn.sendall(h2conn.data_to_send())
+
+    @staticmethod
+    def _respond(h2conn, stream_id: int, connection_nr: int, headers: dict, body: bytes):
+        status = 404 if headers[':path'] == '/missing' else 200
+        payload = json.dumps({
+            'connection': connection_nr,
+            'method': headers[':method'],
+            'path': headers[':path'],
+            'body': body.decode(),
+            'addon': headers.get('blender-cloud-addon'),
+        }).encode()
+        response_headers = [
+            (':status', str(status)),
+            ('content-type', 'application/json'),
+            ('content-length', str(len(payload))),
+        ]
+        if headers[':path'].startswith('/cacheable'):
+            response_headers += [('cache-control', 'max-age=3600'),
+                                 ('date', email.utils.formatdate(usegmt=True))]
+        h2conn.send_headers(stream_id, response_headers)
+        h2conn.send_data(stream_id, payload, end_stream=True)
+
+
+@unittest.skipUnless(http2.is_available(), 'httpx and h2 are required for HTTP/2')
+class HTTP2AdapterTest(unittest.TestCase):
+    def setUp(self):
+        self.server = LocalHTTP2Server()
+        self.server.start()
+
+        self.adapter = http2.HTTP2Adapter(pool_maxsize=4, http1=False)
+        self.session = requests.session()
+        self.session.mount('http://', self.adapter)
+        self.session.headers['Blender-Cloud-Addon'] = '1.17'
+
+    def tearDown(self):
+        self.session.close()
+        self.server.stop()
+
+    def test_get(self):
+        resp = self.session.get(self.server.url('/api/nodes?where=%7B%7D'))
+        # The server only speaks HTTP/2, so any response means it was used.
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual({'connection': 1, 'method': 'GET', 'path': '/api/nodes?where=%7B%7D',
+                          'body': '', 'addon': '1.17'}, resp.json())
+
+    def test_post(self):
+        resp = self.session.post(self.server.url('/api/nodes'), json={'name': 'node'})
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual('POST', resp.json()['method'])
+        self.assertEqual({'name': 'node'}, json.loads(resp.json()['body']))
+
+    def test_error_status(self):
+        resp = self.session.get(self.server.url('/missing'))
+        self.assertEqual(404, resp.status_code)
+        with self.assertRaises(requests.exceptions.HTTPError):
+            resp.raise_for_status()
+
+    def test_concurrent_requests_share_connection(self):
+        def get(index):
+            resp = self.session.get(self.server.url('/api/files/%d' % index))
+            resp.raise_for_status()
+            return resp.json()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(get, range(40)))
+
+        self.assertEqual(['/api/files/%d' % index for index in range(40)],
+                         [result['path'] for result in results])
+        self.assertEqual({1}, {result['connection'] for result in results})
+        self.assertEqual(1, self.server.connection_count)
+
+    def test_connection_error(self):
+        # Bind without listening, so that connections to this port are refused.
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+
+        session = requests.session()
+        session.mount('http://', http2.HTTP2Adapter(http1=False))
+
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            session.get('http://127.0.0.1:%d/' % port)
+
+
+@unittest.skipUnless(http2.is_available(), 'httpx and h2 are required for HTTP/2')
+class CachingHTTP2AdapterTest(unittest.TestCase):
+    def setUp(self):
+        self.server = LocalHTTP2Server()
+        self.server.start()
+
+        adapter = cache.http_adapter(4, adapter_class=cachecontrol.CacheControlAdapter,
+                                     use_http2=True, http1=False,
+                                     cache=cachecontrol.cache.DictCache())
+        self.assertIsInstance(adapter, http2.CachingHTTP2Adapter)
+        self.session = cache.session_with_adapter(adapter)
+
+    def tearDown(self):
+        self.session.close()
+        self.server.stop()
+
+    def test_response_cached(self):
+        for _ in range(3):
+            resp = self.session.get(self.server.url('/cacheable/nodes'))
+            self.assertEqual('/cacheable/nodes', resp.json()['path'])
+        self.assertEqual(1, self.server.request_count)
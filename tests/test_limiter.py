@@ -0,0 +1,189 @@
+"""Unittests for blender_cloud.limiter."""
+
+import asyncio
+import unittest
+import unittest.mock
+
+import requests.exceptions
+
+from blender_cloud import limiter
+from blender_cloud.limiter import Priority
+
+
+class IsOverloadErrorTest(unittest.TestCase):
+    def test_overload_errors(self):
+        response = unittest.mock.Mock(status_code=503)
+        for ex in (asyncio.TimeoutError(),
+                   requests.exceptions.ReadTimeout(),
+                   requests.exceptions.ConnectionError(),
+                   requests.exceptions.HTTPError(response=response)):
+            self.assertTrue(limiter.is_overload_error(ex), ex)
+
+    def test_other_errors(self):
+        response = unittest.mock.Mock(status_code=404)
+        for ex in (ValueError(), requests.exceptions.HTTPError(response=response)):
+            self.assertFalse(limiter.is_overload_error(ex), ex)
+
+
+class AdaptiveLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(self.loop.close)
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_priority_order(self):
+        lim = limiter.AdaptiveLimiter('test', 1)
+        started = []
+
+        async def operation(name, priority):
+            async with lim.slot(priority):
+                started.append(name)
+                await asyncio.sleep(0)
+
+        async def main():
+            # Occupy the only slot, so that the others have to queue up.
+            await lim.acquire()
+            tasks = [asyncio.ensure_future(operation(name, priority)) for name, priority in [
+                ('background', Priority.BACKGROUND),
+                ('visible-1', Priority.VISIBLE),
+                ('interactive', Priority.INTERACTIVE),
+                ('visible-2', Priority.VISIBLE),
+            ]]
+            await asyncio.sleep(0)
+            lim.release(success=True)
+            await asyncio.gather(*tasks)
+
+        self.run_async(main())
+        self.assertEqual(['interactive', 'visible-1', 'visible-2', 'background'], started)
+
+    def test_additive_increase(self):
+        lim = limiter.AdaptiveLimiter('test', 2, max_limit=3)
+
+        async def main():
+            for _ in range(4):
+                await lim.acquire()
+                await lim.acquire()
+                lim.release(success=True)
+                lim.release(success=True)
+
+        self.run_async(main())
+        # Every full round of 'limit' successes adds one, up to the maximum.
+        self.assertEqual(3, lim.limit)
+        self.assertEqual(0, lim.in_flight)
+
+    def test_no_increase_below_limit(self):
+        lim = limiter.AdaptiveLimiter('test', 2)
+
+        async def main():
+            for _ in range(10):
+                await lim.acquire()
+                lim.release(success=True)
+
+        self.run_async(main())
+        self.assertEqual(2, lim.limit)
+
+    def test_multiplicative_decrease(self):
+        lim = limiter.AdaptiveLimiter('test', 8, backoff_secs=0)
+
+        async def failing():
+            async with lim.slot():
+                raise requests.exceptions.ConnectTimeout()
+
+        with self.assertRaises(requests.exceptions.ConnectTimeout):
+            self.run_async(failing())
+        self.assertEqual(4, lim.limit)
+
+        for _ in range(5):
+            with self.assertRaises(requests.exceptions.ConnectTimeout):
+                self.run_async(failing())
+        self.assertEqual(lim.min_limit, lim.limit)
+        self.assertEqual(0, lim.in_flight)
+
+    def test_decrease_backoff(self):
+        lim = limiter.AdaptiveLimiter('test', 8, backoff_secs=3600)
+
+        async def main():
+            for _ in range(3):
+                await lim.acquire()
+            for _ in range(3):
+                lim.release(success=False, overloaded=True)
+
+        self.run_async(main())
+        # A burst of failures from the same overload only halves the limit once.
+        self.assertEqual(4, lim.limit)
+
+    def test_cancelled_waiter(self):
+        lim = limiter.AdaptiveLimiter('test', 1)
+
+        async def main():
+            await lim.acquire()
+            waiter = asyncio.ensure_future(lim.acquire())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            self.assertEqual(0, len(lim._waiters))
+
+            lim.release(success=True)
+            await asyncio.wait_for(lim.acquire(), 1)
+
+        self.run_async(main())
+        self.assertEqual(1, lim.in_flight)
+
+    def test_cancelled_before_release(self):
+        lim = limiter.AdaptiveLimiter('test', 1)
+
+        async def main():
+            await lim.acquire()
+            waiter = asyncio.ensure_future(lim.acquire())
+            await asyncio.sleep(0)
+            # The release pops the cancelled waiter before it gets to run.
+            waiter.cancel()
+            lim.release(success=True)
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            self.assertEqual(0, len(lim._waiters))
+
+            await asyncio.wait_for(lim.acquire(), 1)
+
+        self.run_async(main())
+        self.assertEqual(1, lim.in_flight)
+
+    def test_cancelled_after_wakeup(self):
+        lim = limiter.AdaptiveLimiter('test', 1)
+
+        async def main():
+            await lim.acquire()
+            waiter = asyncio.ensure_future(lim.acquire())
+            await asyncio.sleep(0)
+            # Hand the slot to the waiter, but cancel it before it gets to run.
+            lim.release(success=True)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+
+        self.run_async(main())
+        # The slot handed to the cancelled waiter is released again.
+        self.assertEqual(0, lim.in_flight)
+
+    def test_cancelled_inside_slot(self):
+        lim = limiter.AdaptiveLimiter('test', 1)
+
+        async def hold():
+            async with lim.slot():
+                await asyncio.sleep(3600)
+
+        async def main():
+            task = asyncio.ensure_future(hold())
+            await asyncio.sleep(0)
+            self.assertEqual(1, lim.in_flight)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        self.run_async(main())
+        self.assertEqual(0, lim.in_flight)
+        self.assertEqual(1, lim.limit)
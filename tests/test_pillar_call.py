@@ -0,0 +1,201 @@
+"""Unittests for blender_cloud.pillar.pillar_call() and the credentials check built on it."""
+
+import asyncio
+import sys
+import threading
+import types
+import unittest.mock
+
+import pillarsdk
+
+from blender_cloud import limiter, pillar
+
+
+class FakeResource:
+    """Stands in for a Pillar SDK resource class."""
+
+    calls = []
+    proceed = threading.Event()
+
+    @classmethod
+    def find(cls, resource_id, api=None):
+        cls.calls.append(resource_id)
+        if not cls.proceed.wait(5):
+            raise TimeoutError('test did not let the call proceed')
+        return {'_id': resource_id}
+
+    @classmethod
+    def update(cls, resource_id, api=None):
+        return cls.find(resource_id, api=api)
+
+
+class AbstractPillarCallTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(self.close_loop)
+
+        FakeResource.calls = []
+        FakeResource.proceed = threading.Event()
+        patchers = [
+            unittest.mock.patch.object(pillar, 'pillar_api', return_value='api'),
+            unittest.mock.patch.object(pillar, 'pillar_limiter',
+                                       limiter.AdaptiveLimiter('pillar', 8)),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def close_loop(self):
+        # Let calls that are still running in the executor finish.
+        FakeResource.proceed.set()
+        self.loop.run_until_complete(self.loop.shutdown_default_executor())
+        self.loop.close()
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro, 5))
+
+    async def wait_for_calls(self, count: int):
+        while len(FakeResource.calls) < count:
+            await asyncio.sleep(0.001)
+
+
+class CoalescingTest(AbstractPillarCallTest):
+    def test_identical_calls_shared(self):
+        async def main():
+            calls = [asyncio.ensure_future(pillar.pillar_call(FakeResource.find, resource_id))
+                     for resource_id in ('a', 'a', 'b', 'a')]
+            await self.wait_for_calls(2)
+            FakeResource.proceed.set()
+            return await asyncio.gather(*calls)
+
+        results = self.run_async(main())
+        self.assertEqual(['a', 'b'], sorted(FakeResource.calls))
+        self.assertEqual([{'_id': 'a'}, {'_id': 'a'}, {'_id': 'b'}, {'_id': 'a'}], results)
+        self.assertIs(results[0], results[1])
+        self.assertEqual({}, pillar._in_flight_calls)
+
+    def test_other_methods_not_shared(self):
+        async def main():
+            calls = [asyncio.ensure_future(pillar.pillar_call(FakeResource.update, 'a'))
+                     for _ in range(2)]
+            await self.wait_for_calls(2)
+            FakeResource.proceed.set()
+            return await asyncio.gather(*calls)
+
+        self.run_async(main())
+        self.assertEqual(['a', 'a'], FakeResource.calls)
+
+    def test_cancelled_waiter(self):
+        async def main():
+            first = asyncio.ensure_future(pillar.pillar_call(FakeResource.find, 'a'))
+            second = asyncio.ensure_future(pillar.pillar_call(FakeResource.find, 'a'))
+            await self.wait_for_calls(1)
+
+            first.cancel()
+            await asyncio.sleep(0)
+            FakeResource.proceed.set()
+            with self.assertRaises(asyncio.CancelledError):
+                await first
+            return await second
+
+        # Cancelling one caller doesn't cancel the call for the other.
+        self.assertEqual({'_id': 'a'}, self.run_async(main()))
+        self.assertEqual(['a'], FakeResource.calls)
+
+    def test_all_waiters_cancelled(self):
+        async def main():
+            callers = [asyncio.ensure_future(pillar.pillar_call(FakeResource.find, 'a'))
+                       for _ in range(2)]
+            await self.wait_for_calls(1)
+            shared_task = pillar._in_flight_calls[next(iter(pillar._in_flight_calls))].task
+
+            for caller in callers:
+                caller.cancel()
+            results = await asyncio.gather(*callers, return_exceptions=True)
+            self.assertEqual(2, sum(isinstance(result, asyncio.CancelledError)
+                                    for result in results))
+            await asyncio.sleep(0)
+            self.assertTrue(shared_task.cancelled())
+            self.assertEqual({}, pillar._in_flight_calls)
+
+            # A new call isn't attached to the cancelled one.
+            FakeResource.proceed.set()
+            return await pillar.pillar_call(FakeResource.find, 'a')
+
+        self.assertEqual({'_id': 'a'}, self.run_async(main()))
+        self.assertEqual(['a', 'a'], FakeResource.calls)
+        self.assertEqual(0, pillar.pillar_limiter.in_flight)
+
+
+class CredentialsCacheTest(AbstractPillarCallTest):
+    def setUp(self):
+        super().setUp()
+
+        self.me_calls = 0
+        self.subclient = {'subclient_user_id': 'user-1', 'token': 'token-1'}
+        profile = unittest.mock.Mock(subclients={pillar.SUBCLIENT_ID: self.subclient})
+
+        def find_from_endpoint(cls, url, params=None, api=None):
+            self.me_calls += 1
+            return pillarsdk.User({'_id': 'user-1', 'roles': ['subscriber']})
+
+        patchers = [
+            unittest.mock.patch.object(pillar, 'blender_id_profile', return_value=profile),
+            unittest.mock.patch.object(pillarsdk.User, 'find_from_endpoint',
+                                       classmethod(find_from_endpoint)),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        pillar.invalidate_credentials_cache()
+        self.addCleanup(pillar.invalidate_credentials_cache)
+
+    def check(self):
+        return self.run_async(pillar.check_pillar_credentials({'subscriber'}))
+
+    def test_cached_within_ttl(self):
+        first = self.check()
+        second = self.check()
+
+        self.assertEqual(1, self.me_calls)
+        self.assertIs(first, second)
+
+    def test_expired(self):
+        with unittest.mock.patch.object(pillar, 'CREDENTIALS_CACHE_TTL_SECS', 0):
+            self.check()
+            self.check()
+        self.assertEqual(2, self.me_calls)
+
+    def test_token_changed(self):
+        self.check()
+        self.subclient['token'] = 'token-2'
+        self.check()
+        self.assertEqual(2, self.me_calls)
+
+    def test_invalidated_by_rejected_call(self):
+        self.check()
+        for error_class in (pillarsdk.UnauthorizedAccess, pillarsdk.ForbiddenAccess):
+            def rejected(api=None):
+                raise error_class(unittest.mock.Mock(status_code=403))
+
+            with self.assertRaises(error_class):
+                self.run_async(pillar.pillar_call(rejected))
+            self.check()
+        self.assertEqual(3, self.me_calls)
+
+    def test_invalidated_by_refresh(self):
+        blender_id = types.ModuleType('blender_id')
+        blender_id.create_subclient_token = unittest.mock.Mock()
+        blender_id.communication = types.SimpleNamespace(BlenderIdCommError=RuntimeError)
+        blender = types.ModuleType('blender_cloud.blender')
+        blender.preferences = unittest.mock.Mock()
+
+        self.check()
+        with unittest.mock.patch.dict(sys.modules, {'blender_id': blender_id,
+                                                    'blender_cloud.blender': blender}):
+            self.run_async(pillar.refresh_pillar_credentials({'subscriber'}))
+
+        self.assertEqual(2, self.me_calls)
+        blender_id.create_subclient_token.assert_called_once_with(
+            pillar.SUBCLIENT_ID, blender.preferences().pillar_server)
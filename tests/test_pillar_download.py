@@ -0,0 +1,381 @@
+"""Unittests for downloading with blender_cloud.pillar.download_to_file().
+
+These run against a minimal HTTP server on localhost.
+"""
+
+import asyncio
+import gzip
+import http.server
+import io
+import json
+import pathlib
+import tempfile
+import threading
+import unittest.mock
+
+from blender_cloud import download_index, limiter, pillar
+
+CONTENT = bytes(range(256)) * 64
+ETAG = '"v2"'
+
+
+class FileHandler(http.server.BaseHTTPRequestHandler):
+    """Serves CONTENT, honouring Range and If-Range headers like a regular server."""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'TestServer'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.request_headers.append({
+            'Range': self.headers.get('Range'),
+            'If-Range': self.headers.get('If-Range'),
+        })
+        self.server.accept_encodings.append(self.headers.get('Accept-Encoding'))
+
+        if self.headers.get('If-None-Match') == ETAG:
+            self.server.not_modified += 1
+            self.send_response(304)
+            self.send_header('ETag', ETAG)
+            self.end_headers()
+            return
+
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if self.server.mode == 'gzip':
+            # Compress, even though the client asked not to.
+            self._send(200, gzip.compress(CONTENT), {'Content-Encoding': 'gzip'})
+            return
+        if range_header and self.server.mode == 'unsatisfiable':
+            self._send(416, b'')
+            return
+        if (range_header and self.server.mode == 'ranges'
+                and (if_range is None or if_range == ETAG)):
+            start, end = range_header.split('=', 1)[1].split('-')
+            body = CONTENT[int(start):int(end) + 1 if end else None]
+            self._send(206, body, {'Content-Range': 'bytes %s-%d/%d' % (
+                start, int(start) + len(body) - 1, len(CONTENT))})
+            return
+        self._send(200, CONTENT)
+
+    def _send(self, status: int, body: bytes, headers=None):
+        self.send_response(status)
+        self.send_header('ETag', ETAG)
+        if self.server.accept_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class AbstractDownloadTest(unittest.TestCase):
+    async_http_downloads = True
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmp = pathlib.Path(self.tmpdir.name)
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+        self.server.mode = 'ranges'
+        self.server.accept_ranges = True
+        self.server.request_headers = []
+        self.server.accept_encodings = []
+        self.server.not_modified = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/file.bin' % self.server.server_port
+
+        self.filename = str(self.tmp / 'file.bin')
+        self.part_path = self.filename + '.part'
+        self.checkpoint_path = self.part_path + '.json'
+
+        # Keep the download index out of the user's cache directory.
+        patchers = [
+            unittest.mock.patch('blender_cloud.cache.cache_directory', return_value=str(self.tmp)),
+            unittest.mock.patch.object(pillar, 'ASYNC_HTTP_DOWNLOADS', self.async_http_downloads),
+            unittest.mock.patch.object(pillar, 'download_limiter',
+                                       limiter.AdaptiveLimiter('downloads', 4)),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmpdir.cleanup()
+
+    def download(self, *urls, file_size: int = None):
+        """Downloads the URLs (default self.url) to self.filename, one after the other."""
+
+        async def download_all():
+            for url in urls or [self.url]:
+                await pillar.download_to_file(url, self.filename,
+                                              header_store=self.filename + '.headers',
+                                              file_size=file_size)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(download_all())
+        finally:
+            loop.close()
+
+    def make_partial(self, size: int, etag=ETAG, content_length=len(CONTENT)):
+        with open(self.part_path, 'wb') as outfile:
+            outfile.write(CONTENT[:size])
+        with open(self.checkpoint_path, 'w') as outfile:
+            json.dump({'ETag': etag, 'Last-Modified': None,
+                       'Content-Length': content_length, 'ranges': None}, outfile)
+
+    def assert_downloaded(self):
+        self.assertEqual(CONTENT, pathlib.Path(self.filename).read_bytes())
+        self.assertFalse(pathlib.Path(self.part_path).exists())
+        self.assertFalse(pathlib.Path(self.checkpoint_path).exists())
+
+
+class ResumeDownloadTest(AbstractDownloadTest):
+    def test_resume_partial_content(self):
+        self.make_partial(1000)
+        self.download()
+
+        self.assert_downloaded()
+        self.assertEqual([{'Range': 'bytes=1000-%d' % (len(CONTENT) - 1), 'If-Range': ETAG}],
+                         self.server.request_headers)
+        self.assertEqual(['identity'], self.server.accept_encodings)
+
+    def test_range_ignored(self):
+        self.server.mode = 'full'
+        self.make_partial(1000)
+        self.download()
+
+        self.assert_downloaded()
+        self.assertEqual(1, len(self.server.request_headers))
+
+    def test_range_not_satisfiable(self):
+        self.server.mode = 'unsatisfiable'
+        self.make_partial(1000)
+        self.download()
+
+        self.assert_downloaded()
+        self.assertEqual([{'Range': 'bytes=1000-%d' % (len(CONTENT) - 1), 'If-Range': ETAG},
+                          {'Range': None, 'If-Range': None}],
+                         self.server.request_headers)
+
+    def test_stale_checkpoint(self):
+        # The file changed on the server since the checkpoint was made, so the
+        # server ignores the Range header and sends the entire new file.
+        self.make_partial(1000, etag='"v1"')
+        self.download()
+
+        self.assert_downloaded()
+        self.assertEqual([{'Range': 'bytes=1000-%d' % (len(CONTENT) - 1), 'If-Range': '"v1"'}],
+                         self.server.request_headers)
+
+    def test_part_larger_than_checkpoint(self):
+        self.make_partial(len(CONTENT), content_length=1000)
+        self.download()
+
+        self.assert_downloaded()
+        self.assertEqual([{'Range': None, 'If-Range': None}], self.server.request_headers)
+
+    def test_resumed_download_wrong_length(self):
+        # The checkpoint claims a size that the server doesn't deliver.
+        self.make_partial(1000, content_length=len(CONTENT) + 10)
+        self.download()
+
+        self.assert_downloaded()
+        self.assertEqual(2, len(self.server.request_headers))
+        self.assertEqual({'Range': None, 'If-Range': None}, self.server.request_headers[-1])
+
+    def test_small_download_not_checkpointed(self):
+        with unittest.mock.patch.object(pillar, '_save_checkpoint') as save:
+            self.download()
+
+        self.assert_downloaded()
+        self.assertFalse(save.called)
+
+    def test_large_download_checkpointed(self):
+        with unittest.mock.patch.object(pillar, 'DOWNLOAD_CHECKPOINT_MIN_SIZE', 1024), \
+                unittest.mock.patch.object(pillar, '_save_checkpoint',
+                                           wraps=pillar._save_checkpoint) as save:
+            self.download()
+
+        self.assert_downloaded()
+        save.assert_called_once_with(self.checkpoint_path, unittest.mock.ANY)
+
+    def test_concurrent_downloads_to_same_file(self):
+        async def download_all():
+            await asyncio.gather(*(
+                pillar.download_to_file(self.url, self.filename,
+                                        header_store=self.filename + '.headers')
+                for _ in range(6)))
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(download_all())
+        finally:
+            loop.close()
+
+        self.assert_downloaded()
+        # The others found the file freshly downloaded by the first.
+        self.assertEqual(1, len(self.server.request_headers))
+        self.assertEqual({}, pillar._download_locks)
+
+    def test_sidecar_headers_imported(self):
+        header_store = pathlib.Path(self.filename + '.headers')
+        pathlib.Path(self.filename).write_bytes(CONTENT)
+        header_store.write_text(json.dumps({'ETag': ETAG, 'Last-Modified': None,
+                                            'Content-Length': str(len(CONTENT))}))
+        self.download()
+
+        self.assertEqual(1, self.server.not_modified)
+        self.assertFalse(header_store.exists())
+        entry = download_index.lookup(self.filename)
+        self.assertEqual((self.url, len(CONTENT), ETAG),
+                         (entry.url, entry.size, entry.etag))
+        self.assertTrue(download_index.is_fresh(self.url, self.filename))
+
+    def test_changed_url(self):
+        # Signed storage links change, while the file they point to doesn't.
+        new_url = self.url + '?signature=new'
+        self.download(self.url, new_url)
+
+        # The file was validated recently, so the new link doesn't need checking.
+        self.assertEqual(1, len(self.server.request_headers))
+        self.assertEqual(new_url, download_index.lookup(self.filename).url)
+
+    def test_changed_url_stale(self):
+        new_url = self.url + '?signature=new'
+        with unittest.mock.patch.object(download_index, 'FRESHNESS_WINDOW_SECS', -1):
+            self.download(self.url, new_url)
+
+        # The conditional request to the new link reuses the validators of the old one.
+        self.assertEqual(2, len(self.server.request_headers))
+        self.assertEqual(1, self.server.not_modified)
+        self.assertEqual(new_url, download_index.lookup(self.filename).url)
+        self.assertTrue(download_index.is_fresh(new_url, self.filename))
+
+
+class RequestsResumeDownloadTest(ResumeDownloadTest):
+    """Same tests, downloading with Requests instead of async_http."""
+
+    async_http_downloads = False
+
+    def test_compressed_anyway(self):
+        # The Content-Length is that of the compressed body, so it can't be checked.
+        self.server.mode = 'gzip'
+        self.download()
+
+        self.assert_downloaded()
+        self.assertEqual(['identity'], self.server.accept_encodings)
+
+
+class RangedDownloadTest(AbstractDownloadTest):
+    """Downloads CONTENT in RANGED_DOWNLOAD_PARTS byte ranges of 4 KiB each."""
+
+    async_http_downloads = False
+
+    def setUp(self):
+        super().setUp()
+        patcher = unittest.mock.patch.object(pillar, 'RANGED_DOWNLOAD_MIN_SIZE', 1024)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_ranged_download(self):
+        self.download(file_size=len(CONTENT))
+
+        self.assert_downloaded()
+        # The first range is read from the body of the first, regular GET request.
+        self.assertEqual({'Range': None, 'If-Range': None}, self.server.request_headers[0])
+        self.assertEqual([{'Range': 'bytes=%d-%d' % (start, start + 4095), 'If-Range': ETAG}
+                          for start in (4096, 8192, 12288)],
+                         sorted(self.server.request_headers[1:],
+                                key=lambda headers: int(headers['Range'][6:].split('-')[0])))
+
+    def test_resume_ranges(self):
+        # Ranges are [next offset, end]; bytes 1000-4095 and 8692-12287 are missing.
+        ranges = [[1000, 4096], [8192, 8192], [8692, 12288], [16384, 16384]]
+        partial = bytearray(CONTENT)
+        partial[1000:4096] = bytes(3096)
+        partial[8692:12288] = bytes(3596)
+        pathlib.Path(self.part_path).write_bytes(partial)
+        with open(self.checkpoint_path, 'w') as outfile:
+            json.dump({'ETag': ETAG, 'Last-Modified': None,
+                       'Content-Length': len(CONTENT), 'ranges': ranges}, outfile)
+
+        self.download(file_size=len(CONTENT))
+
+        self.assert_downloaded()
+        self.assertEqual([{'Range': 'bytes=1000-4095', 'If-Range': ETAG},
+                          {'Range': 'bytes=8692-12287', 'If-Range': ETAG}],
+                         self.server.request_headers)
+
+    def test_no_accept_ranges(self):
+        self.server.accept_ranges = False
+        self.download(file_size=len(CONTENT))
+
+        self.assert_downloaded()
+        self.assertEqual([{'Range': None, 'If-Range': None}], self.server.request_headers)
+
+
+class GzipHandler(http.server.BaseHTTPRequestHandler):
+    """Serves a gzip-encoded body that decodes to much more than a chunk."""
+
+    protocol_version = 'HTTP/1.1'
+    content = bytes(range(256)) * 469
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        body = gzip.compress(self.content)
+        self.send_response(200)
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class PipelinedDownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), GzipHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/file.bin' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_encoded_body(self):
+        response = pillar.download_session.get(self.url, stream=True)
+        blocks = list(pillar._iter_adaptive_chunks(response, 100 * 1024))
+
+        # The compressed body is read in one go, the rest is decoded from the buffer.
+        self.assertEqual(GzipHandler.content, b''.join(blocks))
+
+    def test_adaptive_chunk_size(self):
+        response = pillar.download_session.get(self.url, stream=True)
+        with unittest.mock.patch.object(pillar, 'DOWNLOAD_CHUNK_TARGET_SECS', 3600):
+            blocks = list(pillar._iter_adaptive_chunks(response, 1024))
+
+        self.assertEqual(GzipHandler.content, b''.join(blocks))
+        self.assertEqual([1024, 2048, 4096, 8192], [len(block) for block in blocks[:4]])
+
+    def test_write_pipelined(self):
+        outfile = io.BytesIO()
+        blocks = [bytes([i]) * 100 for i in range(3 * pillar.DOWNLOAD_QUEUE_SIZE)]
+        pillar._write_pipelined(iter(blocks), outfile)
+        self.assertEqual(b''.join(blocks), outfile.getvalue())
+
+    def test_write_error(self):
+        outfile = unittest.mock.Mock()
+        outfile.write.side_effect = OSError('disk full')
+        blocks = (b'block' for _ in range(3 * pillar.DOWNLOAD_QUEUE_SIZE))
+
+        with self.assertRaises(OSError):
+            pillar._write_pipelined(blocks, outfile)
+        # The writer stopped at the first error.
+        self.assertEqual(1, outfile.write.call_count)
@@ -0,0 +1,71 @@
+"""Unittests for batching File lookups with blender_cloud.pillar.find_file_doc()."""
+
+import asyncio
+import unittest.mock
+
+from blender_cloud import pillar
+
+
+class FileBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+        self.calls = []
+        patcher = unittest.mock.patch.object(pillar, 'pillar_call', self.fake_pillar_call)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def fake_pillar_call(self, pillar_func, params, **kwargs):
+        self.calls.append(params['where']['_id']['$in'])
+        await asyncio.sleep(0)
+        return {'_items': [{'_id': file_id} for file_id in params['where']['_id']['$in']
+                           if file_id != 'missing']}
+
+    def find(self, *file_ids):
+        async def find_all():
+            return await asyncio.gather(
+                *(pillar.find_file_doc(file_id, {'link': 1}) for file_id in file_ids),
+                return_exceptions=True)
+        return self.loop.run_until_complete(find_all())
+
+    def test_single_query(self):
+        results = self.find('a', 'b', 'missing', 'a')
+
+        self.assertEqual([['a', 'b', 'missing']], self.calls)
+        self.assertEqual([{'_id': 'a'}, {'_id': 'b'}, None, {'_id': 'a'}], results)
+
+    def test_error_passed_to_waiters(self):
+        async def failing_call(*args, **kwargs):
+            raise ConnectionError('offline')
+
+        with unittest.mock.patch.object(pillar, 'pillar_call', failing_call):
+            results = self.find('a', 'b')
+
+        self.assertEqual(2, len(results))
+        for result in results:
+            self.assertIsInstance(result, ConnectionError)
+
+    def test_cancelled_batch(self):
+        started = asyncio.Event()
+
+        async def hanging_call(*args, **kwargs):
+            started.set()
+            await asyncio.sleep(3600)
+
+        async def find_and_cancel():
+            lookups = asyncio.gather(pillar.find_file_doc('a', {'link': 1}),
+                                     pillar.find_file_doc('b', {'link': 1}),
+                                     return_exceptions=True)
+            await started.wait()
+            for task in asyncio.all_tasks():
+                if task.get_coro().__name__ == '_fetch_file_batch':
+                    task.cancel()
+            return await asyncio.wait_for(lookups, 5)
+
+        with unittest.mock.patch.object(pillar, 'pillar_call', hanging_call):
+            results = self.loop.run_until_complete(find_and_cancel())
+
+        self.assertEqual(2, len(results))
+        for result in results:
+            self.assertIsInstance(result, asyncio.CancelledError)
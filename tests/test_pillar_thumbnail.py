@@ -0,0 +1,53 @@
+"""Unittests for finding thumbnail links with blender_cloud.pillar.fetch_thumbnail_info()."""
+
+import asyncio
+import os.path
+import unittest.mock
+
+import pillarsdk
+
+from blender_cloud import limiter, pillar
+
+
+class ThumbnailInfoTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+        self.calls = []
+        patcher = unittest.mock.patch.object(pillar, 'pillar_call', self.fake_pillar_call)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def fake_pillar_call(self, pillar_func, *args, **kwargs):
+        self.calls.append((pillar_func.__name__, args, kwargs))
+        return 'https://storage/remote-t.jpg'
+
+    def fetch(self, file_doc: dict, desired_size='t'):
+        file = pillarsdk.File(dict(file_doc, _id='5672beecc0261b2005ed1a33',
+                                   file_path='brick.png'))
+        return self.loop.run_until_complete(
+            pillar.fetch_thumbnail_info(file, '/tmp/thumbs', desired_size))
+
+    def test_variation_known(self):
+        url, path = self.fetch({'variations': [
+            {'size': 's', 'link': 'https://storage/brick-s.jpg'},
+            {'size': 't', 'link': 'https://storage/brick-t.jpg'},
+        ]})
+
+        self.assertEqual([], self.calls)
+        self.assertEqual('https://storage/brick-t.jpg', url)
+        self.assertEqual(os.path.abspath('/tmp/thumbs/brick-t.jpg'), path)
+
+    def test_variation_unknown(self):
+        url, _ = self.fetch({'variations': [{'size': 's', 'link': 'https://storage/brick-s.jpg'}]})
+
+        self.assertEqual([('thumbnail', ('t',), {'priority': limiter.Priority.VISIBLE})],
+                         self.calls)
+        self.assertEqual('https://storage/remote-t.jpg', url)
+
+    def test_no_variations(self):
+        url, _ = self.fetch({})
+
+        self.assertEqual(1, len(self.calls))
+        self.assertEqual('https://storage/remote-t.jpg', url)